@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the recognition hot paths.
+
+Usage: python benchmark.py <benchmark> [options]
+Run `python benchmark.py --help` to list the available benchmarks.
+"""
+
+import argparse
+import time
+import numpy as np
+
+
+def synthetic_gallery(size, dim=512, seed=0):
+    """Clustered unit vectors standing in for enrolled face embeddings"""
+    rng = np.random.default_rng(seed)
+    clusters = rng.normal(size=(max(1, size // 50), dim)).astype(np.float32)
+    matrix = clusters[rng.integers(0, len(clusters), size)] + 0.8 * rng.normal(size=(size, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.ascontiguousarray(matrix, dtype=np.float32)
+
+
+def synthetic_queries(matrix, count, noise=0.04, seed=1):
+    """Noisy copies of enrolled faces, with the row they were taken from"""
+    rng = np.random.default_rng(seed)
+    truth = rng.integers(0, len(matrix), count)
+    queries = matrix[truth] + noise * rng.normal(size=(count, matrix.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype(np.float32), truth
+
+
+def _report(label, timings_ms, extra=""):
+    timings_ms = np.asarray(timings_ms)
+    print(f"{label:<28} mean {timings_ms.mean():8.3f} ms   p99 {np.percentile(timings_ms, 99):8.3f} ms   {extra}")
+
+
+def bench_index(args):
+    """Recall@1 and latency of the IVF index against the exact scan"""
+    from face_index import IVFFlatIndex
+
+    matrix = synthetic_gallery(args.size)
+    queries, _ = synthetic_queries(matrix, args.queries)
+    print(f"Gallery: {args.size} x {matrix.shape[1]}, {args.queries} queries")
+
+    exact_best, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        exact_best.append(int(np.argmax(matrix @ query)))
+        timings.append((time.perf_counter() - start) * 1000)
+    _report("exact", timings, "recall@1 1.000")
+
+    start = time.perf_counter()
+    index = IVFFlatIndex.train(matrix, nlist=args.nlist)
+    print(f"IVF training took {time.perf_counter() - start:.2f} s")
+
+    for nprobe in args.nprobe:
+        index.nprobe = min(nprobe, len(index.centroids))
+        hits, timings = 0, []
+        for query, expected in zip(queries, exact_best):
+            start = time.perf_counter()
+            rows = index.candidates(query)
+            best = int(rows[np.argmax(matrix[rows] @ query)])
+            timings.append((time.perf_counter() - start) * 1000)
+            hits += best == expected
+        _report(f"ivf nprobe={index.nprobe}", timings, f"recall@1 {hits / len(queries):.3f}")
+
+
+def bench_quantization(args):
+    """Memory per identity, scan time and decision agreement of the quantized gallery modes"""
+    from face_index import ExactIndex, QuantizedIndex, bytes_per_identity
+
+    matrix = synthetic_gallery(args.size)
+    queries, _ = synthetic_queries(matrix, args.queries)
+    print(f"Gallery: {args.size} x {matrix.shape[1]}, {args.queries} queries, threshold {args.threshold}")
+
+    exact = [(int(np.argmax(matrix @ q)), float(np.max(matrix @ q))) for q in queries]
+    for mode in ["none", "float16", "int8"]:
+        index = ExactIndex() if mode == "none" else QuantizedIndex.build(ExactIndex(), matrix, mode)
+        # Full-precision rows are held in every mode; the codes come on top of them
+        held = bytes_per_identity(matrix, index)
+        agree, timings = 0, []
+        for query, (expected_row, expected_score) in zip(queries, exact):
+            start = time.perf_counter()
+            rows = index.candidates(query)
+            if rows is None:
+                scores = matrix @ query
+                best_row = int(np.argmax(scores))
+            else:
+                scores = matrix[rows] @ query
+                best_row = int(rows[np.argmax(scores)])
+            best_score = float(matrix[best_row] @ query)
+            timings.append((time.perf_counter() - start) * 1000)
+            agree += best_row == expected_row and (best_score > args.threshold) == (expected_score > args.threshold)
+        _report(mode, timings, f"{held:5d} B/identity held   identical decisions {agree}/{len(queries)}")
+
+
+def kiosk_images(args, face_analysis):
+    """Kiosk-style close-ups: the --images files, or 640x480 crops around each face of the InsightFace sample photo"""
+    import glob
+    import cv2
+    if args.images:
+        return [cv2.imread(path) for path in sorted(glob.glob(args.images))]
+    from insightface.data import get_image
+    photo = get_image('t1')
+    images = []
+    for face in face_analysis.get(photo):
+        x1, y1, x2, y2 = face.bbox.astype(int)
+        cx, cy, half = (x1 + x2) // 2, (y1 + y2) // 2, int((x2 - x1) * 1.5)
+        crop = photo[max(0, cy - half):cy + half, max(0, cx - int(half * 4 / 3)):cx + int(half * 4 / 3)]
+        images.append(cv2.resize(crop, (640, 480)))
+    return images
+
+
+def bench_pipeline(args):
+    """Per-frame time of the full buffalo_l pipeline against the fast detection + recognition pipeline"""
+    import model_registry
+    from insightface.app import FaceAnalysis
+
+    full = FaceAnalysis(name=model_registry.MODEL_NAME, providers=model_registry.PROVIDERS)
+    full.prepare(ctx_id=0, det_size=model_registry.DET_SIZE)
+    model_registry.PIPELINE_MODE = 'fast'
+    from face_pipeline import get_faces
+
+    images = kiosk_images(args, full)
+    print(f"{len(images)} kiosk images, fast detection sizes {model_registry.DETECTION_SIZES}")
+    for label, run in [("full (all modules, 640)", full.get), ("fast (det + rec, adaptive)", lambda img: get_faces(img, limit=1))]:
+        for image in images[:2]:
+            run(image)  # warm-up
+        wall, cpu, found = [], [], 0
+        for _ in range(args.repeat):
+            for image in images:
+                start_wall, start_cpu = time.perf_counter(), time.process_time()
+                found += bool(run(image))
+                wall.append((time.perf_counter() - start_wall) * 1000)
+                cpu.append((time.process_time() - start_cpu) * 1000)
+        _report(label, wall, f"cpu {np.mean(cpu):8.2f} ms/frame   faces found {found}/{len(wall)}")
+
+
+def bench_batching(args):
+    """Throughput and latency of concurrent kiosks with and without micro-batching, with
+    frames going through the bounded inference executor exactly like /mark_attendance"""
+    import asyncio
+    import model_registry
+    from inference_scheduler import embedding_batcher
+    from inference_executor import InferenceExecutor, InferenceQueueFull
+    from face_pipeline import get_faces
+
+    model_registry.warm_up()
+    images = kiosk_images(args, model_registry.get_face_analysis())
+    executor = InferenceExecutor()
+    print(f"{len(images)} kiosk images, {args.requests} requests per run, {executor.workers} inference workers")
+
+    async def run_kiosks(clients):
+        """`clients` kiosks sending frames back to back; rejected frames count as rejected, not latency"""
+        pending = iter(range(args.requests))
+        latencies, rejected = [], 0
+
+        async def kiosk():
+            nonlocal rejected
+            for i in pending:
+                start = time.perf_counter()
+                try:
+                    await executor.run(get_faces, images[i % len(images)], 1)
+                except InferenceQueueFull:
+                    rejected += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*(kiosk() for _ in range(clients)))
+        return latencies, rejected
+
+    for window_ms in [0, args.window_ms]:
+        embedding_batcher.window = window_ms / 1000.0
+        for clients in args.clients:
+            embedding_batcher.batches = embedding_batcher.crops = 0
+            start = time.perf_counter()
+            latencies, rejected = asyncio.run(run_kiosks(clients))
+            elapsed = time.perf_counter() - start
+            stats = embedding_batcher.stats()
+            _report(f"window={window_ms}ms clients={clients}", latencies,
+                    f"{len(latencies) / elapsed:7.1f} req/s   mean batch {stats['mean_batch_size']}   rejected {rejected}")
+
+
+def bench_db(args):
+    """Mixed concurrent punches and dashboard reads: a new connection per call with the
+    default rollback journal vs. the pooled WAL connections of database.get_db_connection"""
+    import os
+    import sqlite3
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import date, timedelta
+    import database
+
+    def plain_connection():
+        conn = sqlite3.connect(database.DB_NAME)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    pooled_connection = database.get_db_connection
+    workdir = tempfile.mkdtemp(prefix="attendance-bench-")
+    print(f"{args.employees} employees, {args.requests} requests per run, {args.write_fraction:.0%} punches")
+    for label, connect in [("per-call rollback journal", plain_connection), ("pooled WAL", pooled_connection)]:
+        database.DB_NAME = os.path.join(workdir, f"{label.split()[0]}.db")
+        database.get_db_connection = connect
+        database.init_database()
+        conn = connect()
+        conn.executemany("INSERT INTO employees (id, name) VALUES (?, ?)",
+                         [(f"E{i}", f"Employee {i}") for i in range(args.employees)])
+        conn.commit()
+        conn.close()
+
+        for clients in args.clients:
+            day0 = date(2000, 1, 1) + timedelta(days=clients * 1000)
+            errors = []
+
+            def one_request(i):
+                start = time.perf_counter()
+                try:
+                    if i % 100 < args.write_fraction * 100:
+                        day = (day0 + timedelta(days=i // args.employees)).isoformat()
+                        database.punch_in_employee(f"E{i % args.employees}", day, "09:00:00", "On Time")
+                    else:
+                        conn = database.get_db_connection()
+                        cur = conn.cursor()
+                        cur.execute("SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'On Time'", (day0.isoformat(),))
+                        cur.fetchone()
+                        cur.execute("""
+                            SELECT e.name, a.check_in, a.status FROM attendance a
+                            JOIN employees e ON a.employee_id = e.id
+                            WHERE a.date = ? ORDER BY a.check_in DESC LIMIT 5
+                        """, (day0.isoformat(),))
+                        cur.fetchall()
+                        cur.close()
+                        conn.close()
+                except sqlite3.Error as e:
+                    errors.append(e)
+                return (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                latencies = list(pool.map(one_request, range(args.requests)))
+            elapsed = time.perf_counter() - start
+            _report(f"{label} clients={clients}", latencies,
+                    f"{args.requests / elapsed:7.1f} req/s   errors {len(errors)}")
+    database.get_db_connection = pooled_connection
+
+
+BENCHMARKS = {
+    "index": bench_index,
+    "quantization": bench_quantization,
+    "pipeline": bench_pipeline,
+    "batching": bench_batching,
+    "db": bench_db,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--size", type=int, default=100000, help="number of enrolled faces")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default sqrt(size))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--images", help="glob of kiosk images for the model benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=256, help="requests per concurrency level")
+    parser.add_argument("--window-ms", type=float, default=5.0, help="batching window to compare against no batching")
+    parser.add_argument("--employees", type=int, default=200, help="employees in the database benchmark")
+    parser.add_argument("--write-fraction", type=float, default=0.25, help="share of database requests that are punches")
+    parser.add_argument("--threshold", type=float, default=0.6, help="recognition threshold (recognize_module.THRESHOLD)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,172 @@
 import sqlite3
 import pickle
+import struct
 import base64
 import hashlib
+import numpy as np
 from datetime import datetime
 import os
+import threading
 
 # Use absolute path to backend directory to ensure all scripts use the same database
 BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_NAME = os.path.join(BACKEND_DIR, "attendance.db")
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Face embeddings are stored as a small header followed by raw little-endian floats:
+# magic (4s), format version (B), dtype code (B), dimension (H)
+EMBEDDING_MAGIC = b"FEMB"
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_HEADER = struct.Struct("<4sBBH")
+EMBEDDING_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+# float32 by default, float16 halves the column size at a negligible accuracy cost
+EMBEDDING_STORAGE_DTYPE = os.environ.get('FACE_EMBEDDING_DTYPE', 'float32')
+
+# Idle connections kept open per database file (0 opens a new connection for every call)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# NORMAL is durable across application crashes in WAL mode; FULL also survives power loss
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+# How long a writer waits for the write lock before "database is locked"
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the pool it came from"""
+
+    pool = None
+    checked_out = False
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def discard(self):
+        super().close()
+
+
+def _connect(path, pool=None):
+    conn = sqlite3.connect(path, factory=PooledConnection, check_same_thread=False,
+                           timeout=DB_BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row  # Access columns by name
+    conn.pool = pool
+    # WAL lets dashboard reads run alongside kiosk writes; the journal mode is stored in the file
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
+
+class ConnectionPool:
+    """Reuses configured connections to one database file across threads.
+
+    Never blocks: when every pooled connection is checked out a new one is opened,
+    and at most `size` idle connections are kept. Uncommitted work is rolled back
+    when a connection is returned.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def acquire(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self.reused += 1
+            else:
+                self.opened += 1
+        if conn is None:
+            conn = _connect(self.path, self)
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        if not conn.checked_out:
+            return  # closed twice
+        conn.checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.discard()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+    def stats(self):
+        with self._lock:
+            return {"idle": len(self._idle), "opened": self.opened, "reused": self.reused}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool():
+    with _pools_lock:
+        pool = _pools.get(DB_NAME)
+        if pool is None:
+            pool = _pools[DB_NAME] = ConnectionPool(DB_NAME)
+        return pool
+
+
+def get_db_connection():
+    """A configured connection to the attendance database; close() returns it to the pool"""
+    if DB_POOL_SIZE <= 0:
+        return _connect(DB_NAME)
+    return _pool().acquire()
+
+
+def db_session():
+    """FastAPI dependency yielding a pooled connection for the duration of a request"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def pool_stats():
+    return _pool().stats()
+
+def encode_embedding(embedding, dtype=None):
+    """Serialize an embedding to the raw on-disk format"""
+    code = 2 if (dtype or EMBEDDING_STORAGE_DTYPE) == 'float16' else 1
+    vector = np.asarray(embedding).ravel().astype(EMBEDDING_DTYPES[code])
+    header = EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, code, vector.shape[0])
+    return header + vector.tobytes()
+
+def is_raw_embedding(data):
+    return data is not None and bytes(data[:4]) == EMBEDDING_MAGIC
+
+def decode_embedding(data):
+    """Deserialize an embedding stored by encode_embedding into a float32 array"""
+    if not is_raw_embedding(data):
+        raise ValueError("Unsupported face embedding format (run migrate_face_embeddings_to_raw)")
+    magic, version, code, dim = EMBEDDING_HEADER.unpack_from(data)
+    if version != EMBEDDING_FORMAT_VERSION or code not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unsupported face embedding version {version} / dtype {code}")
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPES[code], count=dim, offset=EMBEDDING_HEADER.size).astype(np.float32)
+
 def init_database():
     """Initialize database with all required tables."""
     conn = get_db_connection()
@@ -101,6 +254,69 @@ def init_database():
             );
         """)
 
+        # Gallery version, lets in-memory and on-disk face galleries detect stale data. The
+        # random token tells databases apart: a recreated or restored one restarts the counter
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS gallery_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                token TEXT
+            );
+        """)
+        cur.execute("PRAGMA table_info(gallery_version)")
+        if 'token' not in [row['name'] for row in cur.fetchall()]:
+            cur.execute("ALTER TABLE gallery_version ADD COLUMN token TEXT")
+        cur.execute("INSERT OR IGNORE INTO gallery_version (id, version) VALUES (1, 0)")
+        cur.execute("UPDATE gallery_version SET token = lower(hex(randomblob(16))) WHERE id = 1 AND token IS NULL")
+        for trigger_name, event in [
+            ('employees_gallery_insert', 'AFTER INSERT ON employees'),
+            ('employees_gallery_delete', 'AFTER DELETE ON employees'),
+            # Profile edits write the name back unchanged; only a real change invalidates the gallery
+            ('employees_gallery_update', 'AFTER UPDATE OF name, face_embedding ON employees '
+                                         'WHEN OLD.name IS NOT NEW.name OR OLD.face_embedding IS NOT NEW.face_embedding'),
+        ]:
+            # Recreated every time so databases made by earlier versions get the current definition
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+            cur.execute(f"""
+                CREATE TRIGGER {trigger_name} {event}
+                BEGIN
+                    UPDATE gallery_version SET version = version + 1 WHERE id = 1;
+                END;
+            """)
+
+        # Attendance side effects (check-in, confirmation emails) already carried out, by idempotency key
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS attendance_events (
+                event_key TEXT PRIMARY KEY,
+                employee_name TEXT NOT NULL,
+                event TEXT NOT NULL,
+                date TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Outgoing emails, delivered by the background sender in mail_outbox.py
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                to_email TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending', -- pending, sending, sent, failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                lease_until REAL, -- while 'sending': when the claiming sender's hold runs out
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)")
+        # Outboxes created before senders claimed their emails
+        cur.execute("PRAGMA table_info(email_outbox)")
+        if 'lease_until' not in [row['name'] for row in cur.fetchall()]:
+            cur.execute("ALTER TABLE email_outbox ADD COLUMN lease_until REAL")
+
         # Initialize Office Settings if empty
         cur.execute("SELECT id FROM office_settings LIMIT 1;")
         if cur.fetchone() is None:
@@ -183,7 +399,7 @@ def get_all_face_embeddings():
             name = row['name']
             embedding_data = row['face_embedding']
             if embedding_data:
-                embedding = pickle.loads(embedding_data)
+                embedding = decode_embedding(embedding_data)
                 embeddings_dict[name] = embedding
         return embeddings_dict
     except Exception as e:
@@ -193,6 +409,44 @@ def get_all_face_embeddings():
         cur.close()
         conn.close()
 
+def get_all_face_embedding_rows():
+    """Get (id, name, embedding) for every employee with a face embedding"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("""
+            SELECT id, name, face_embedding FROM employees 
+            WHERE face_embedding IS NOT NULL
+        """)
+        rows = []
+        for row in cur.fetchall():
+            if row['face_embedding']:
+                rows.append((row['id'], row['name'], decode_embedding(row['face_embedding'])))
+        return rows
+    except Exception as e:
+        print(f"Error getting face embedding rows: {e}")
+        return []
+    finally:
+        cur.close()
+        conn.close()
+
+def get_gallery_version():
+    """"<database token>:<counter>", where the counter is bumped by triggers whenever an
+    employee's name or face embedding changes and the token identifies this database"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT token, version FROM gallery_version WHERE id = 1")
+        result = cur.fetchone()
+        return f"{result[0]}:{result[1]}" if result and result[0] else None
+    except sqlite3.Error as e:
+        print(f"Error getting gallery version: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
 def delete_face_data(employee_id: str):
     """Delete face data when employee is deleted"""
     conn = get_db_connection()
@@ -205,6 +459,9 @@ def delete_face_data(employee_id: str):
             WHERE id = ?
         """, (employee_id,))
         conn.commit()
+        # Import here to avoid circular imports
+        from face_gallery import gallery
+        gallery.remove(employee_id)
         return True
     except Exception as e:
         print(f"Error deleting face data: {e}")
@@ -244,6 +501,168 @@ def punch_out_employee(employee_name: str, date: str):
         cur.close()
         conn.close()
 
+def punch_in_employee(employee_id: str, date: str, check_in: str, check_in_status: str):
+    """Check an employee in on one connection and in one transaction.
+
+    Reads the employee and their attendance row for `date`, then inserts the
+    check-in with `check_in_status` unless a row already exists. BEGIN IMMEDIATE
+    serializes concurrent kiosks, and the UPSERT keeps a second check-in for the
+    same day a no-op. Returns a dict with name, email, checked_in, checked_out,
+    created and status, or None if the employee is unknown or the database failed.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            SELECT e.name, e.email, a.check_in, a.check_out, a.status
+            FROM employees e
+            LEFT JOIN attendance a ON a.employee_id = e.id AND a.date = ?
+            WHERE e.id = ?
+        """, (date, employee_id))
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+
+        punch = {"name": row["name"], "email": row["email"], "checked_in": row["check_in"] is not None,
+                 "checked_out": row["check_out"] is not None, "created": False, "status": row["status"]}
+        if not punch["checked_in"]:
+            cur.execute("""
+                INSERT INTO attendance (employee_id, date, check_in, status)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(employee_id, date) DO NOTHING
+            """, (employee_id, date, check_in, check_in_status))
+            punch.update(checked_in=True, created=cur.rowcount == 1, status=check_in_status)
+        conn.commit()
+        return punch
+    except Exception as e:
+        print(f"Error punching in: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def claim_attendance_event(event_key: str, employee_name: str, event: str, date: str):
+    """Record an attendance event once. Returns True for the first claim of `event_key`,
+    False if it was already recorded (by this or another process)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "INSERT OR IGNORE INTO attendance_events (event_key, employee_name, event, date) VALUES (?, ?, ?, ?)",
+            (event_key, employee_name, event, date)
+        )
+        conn.commit()
+        return cur.rowcount == 1
+    except Exception as e:
+        print(f"Error recording attendance event: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+def enqueue_email(to_email: str, subject: str, body: str):
+    """Add an email to the outbox; returns its id, or None on failure"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT INTO email_outbox (to_email, subject, body) VALUES (?, ?, ?)", (to_email, subject, body))
+        conn.commit()
+        return cur.lastrowid
+    except Exception as e:
+        print(f"Error queueing email: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def claim_due_emails(now: float, limit: int, lease_s: float):
+    """Claim up to `limit` due outbox emails, oldest first, for `lease_s` seconds.
+
+    Claimed rows are set to 'sending' in one BEGIN IMMEDIATE transaction, so
+    the senders of other processes skip them. A claim whose lease ran out
+    (its sender died mid-batch) is due again.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            SELECT id, to_email, subject, body, attempts FROM email_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until <= ?)
+            ORDER BY id LIMIT ?
+        """, (now, now, limit))
+        emails = [dict(row) for row in cur.fetchall()]
+        cur.executemany("UPDATE email_outbox SET status = 'sending', lease_until = ? WHERE id = ?",
+                        [(now + lease_s, email["id"]) for email in emails])
+        conn.commit()
+        return emails
+    except Exception as e:
+        print(f"Error claiming outbox emails: {e}")
+        conn.rollback()
+        return []
+    finally:
+        cur.close()
+        conn.close()
+
+def mark_email_sent(email_id: int):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, lease_until = NULL, sent_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (email_id,))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+def release_emails(email_ids):
+    """Hand claimed emails that weren't attempted back to the outbox"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.executemany(
+            "UPDATE email_outbox SET status = 'pending', lease_until = NULL WHERE id = ? AND status = 'sending'",
+            [(email_id,) for email_id in email_ids]
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+def mark_email_failed(email_id: int, error: str, next_attempt_at=None):
+    """Record a failed attempt; without `next_attempt_at` the email is given up on"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE email_outbox
+            SET attempts = attempts + 1, last_error = ?, status = ?, next_attempt_at = COALESCE(?, next_attempt_at),
+                lease_until = NULL
+            WHERE id = ?
+        """, (error, 'pending' if next_attempt_at is not None else 'failed', next_attempt_at, email_id))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+def get_outbox_counts():
+    """Number of outbox emails per status"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status")
+        return {row[0]: row[1] for row in cur.fetchall()}
+    finally:
+        cur.close()
+        conn.close()
+
 def clear_database():
     """Drops all tables for a clean setup. Use with caution."""
     conn = get_db_connection()
@@ -256,7 +675,16 @@ def clear_database():
         cur.execute("DROP TABLE IF EXISTS employees;")
         cur.execute("DROP TABLE IF EXISTS admin;")
         cur.execute("DROP TABLE IF EXISTS office_settings;")
+        cur.execute("DROP TABLE IF EXISTS gallery_version;")
+        cur.execute("DROP TABLE IF EXISTS attendance_events;")
+        cur.execute("DROP TABLE IF EXISTS email_outbox;")
         conn.commit()
+        # The gallery snapshot and index on disk describe the dropped employees
+        from face_gallery import SNAPSHOT_PATH, SNAPSHOT_META_PATH
+        from face_index import INDEX_PATH
+        for path in (SNAPSHOT_PATH, SNAPSHOT_META_PATH, INDEX_PATH):
+            if os.path.exists(path):
+                os.remove(path)
         print("Database cleared successfully.")
     except Exception as e:
         print(f"Error clearing database: {e}")
@@ -381,3 +809,24 @@ def migrate_add_joining_date_column():
     finally:
         cur.close()
         conn.close()
+
+def migrate_face_embeddings_to_raw():
+    """One-shot conversion of legacy pickled embeddings to the raw float format"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, face_embedding FROM employees WHERE face_embedding IS NOT NULL")
+        legacy_rows = [(row['id'], row['face_embedding']) for row in cur.fetchall() if not is_raw_embedding(row['face_embedding'])]
+        for emp_id, embedding_data in legacy_rows:
+            # Legacy rows were written by this application; they are unpickled once here and never again
+            cur.execute("UPDATE employees SET face_embedding = ? WHERE id = ?",
+                        (encode_embedding(pickle.loads(embedding_data)), emp_id))
+        if legacy_rows:
+            conn.commit()
+            print(f"[MIGRATION] Converted {len(legacy_rows)} pickled face embeddings to raw format.")
+    except Exception as e:
+        print(f"[MIGRATION ERROR] {e}")
+        conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
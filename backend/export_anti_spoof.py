@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Export the MiniFASNet anti-spoof weights to ONNX and check that onnxruntime
+gives the same scores as torch.
+
+Usage: python export_anti_spoof.py [--weights anti_spoof.pth] [--output anti_spoof.onnx]
+
+The server picks the ONNX model up automatically (see ANTI_SPOOF_BACKEND),
+so torch is only needed on the machine running this script.
+"""
+
+import argparse
+import sys
+import numpy as np
+import model_registry
+
+
+def export(weights, output, opset):
+    import torch
+    from utils.anti_spoof_predictor import AntiSpoofPredictor
+    from utils.anti_spoof_input import INPUT_SIZE
+
+    predictor = AntiSpoofPredictor(weights)
+    model = predictor.model.to("cpu").eval()
+    dummy = torch.zeros((1, 3, INPUT_SIZE[1], INPUT_SIZE[0]), dtype=torch.float32)
+    torch.onnx.export(
+        model, dummy, output, opset_version=opset,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+    )
+    print(f"Exported {weights} -> {output} (opset {opset})")
+    return predictor
+
+
+def check_parity(predictor, output, samples, tolerance, seed=0):
+    """Score random crops of assorted sizes, plus all-black and all-white ones, with both backends"""
+    from utils.onnx_anti_spoof_predictor import OnnxAntiSpoofPredictor
+
+    rng = np.random.default_rng(seed)
+    crops = [rng.integers(0, 256, (int(h), int(w), 3), dtype=np.uint8)
+             for h, w in rng.integers(40, 400, (samples, 2))]
+    crops += [np.zeros((80, 80, 3), np.uint8), np.full((80, 80, 3), 255, np.uint8)]
+    onnx_predictor = OnnxAntiSpoofPredictor(output, max_batch_size=predictor.max_batch_size)
+
+    torch_scores = predictor.predict_batch(crops)
+    onnx_scores = onnx_predictor.predict_batch(crops)
+    single = np.array([onnx_predictor.predict(crop) for crop in crops[:8]])
+    max_diff = float(np.abs(torch_scores - onnx_scores).max())
+    batch_diff = float(np.abs(single - onnx_scores[:8]).max())
+    print(f"Parity over {len(crops)} crops: max |torch - onnx| = {max_diff:.2e}, batched vs single = {batch_diff:.2e}")
+    return max_diff <= tolerance and batch_diff <= tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", default=model_registry.ANTI_SPOOF_MODEL_PATH)
+    parser.add_argument("--output", default=model_registry.ANTI_SPOOF_ONNX_PATH)
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument("--samples", type=int, default=64, help="random crops compared between torch and onnxruntime")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="largest allowed score difference")
+    args = parser.parse_args()
+
+    predictor = export(args.weights, args.output, args.opset)
+    if not check_parity(predictor, args.output, args.samples, args.tolerance):
+        print(f"Parity check FAILED (tolerance {args.tolerance})")
+        sys.exit(1)
+    print("Parity check passed")
+
+
+if __name__ == "__main__":
+    main()
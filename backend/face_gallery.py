@@ -0,0 +1,305 @@
+# face_gallery.py
+
+import os
+import json
+import threading
+import numpy as np
+from database import DB_NAME, get_all_face_embedding_rows, get_gallery_version
+from face_index import ExactIndex, build_index
+
+# Memory-mapped snapshot of the gallery, shared read-only by every process that loads it:
+# raw float32 rows, with the version, dimension, ids and names in the metadata file
+SNAPSHOT_PATH = os.path.join(os.path.dirname(DB_NAME), "face_gallery.f32")
+SNAPSHOT_META_PATH = os.path.join(os.path.dirname(DB_NAME), "face_gallery.json")
+
+
+def _snapshot_files():
+    """Identity of the snapshot files on disk; every rewrite or patch changes it"""
+    try:
+        return tuple((st.st_ino, st.st_mtime_ns, st.st_size) for st in map(os.stat, (SNAPSHOT_PATH, SNAPSHOT_META_PATH)))
+    except OSError:
+        return None
+
+
+def normalize_embedding(embedding):
+    """Return a contiguous, L2-normalized float32 copy of an embedding"""
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    return np.ascontiguousarray(vector, dtype=np.float32)
+
+
+class FaceGallery:
+    """Process-resident gallery of enrolled face embeddings.
+
+    Embeddings are kept as one pre-normalized float32 matrix with parallel
+    id/name lists, so a match is a single matrix-vector product plus argmax.
+    A search index (see face_index.py) narrows the rows that get scored on
+    very large galleries. The state tuple is replaced as a whole on every
+    update, which lets `match` read it without taking the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None  # (matrix, ids, names, index) or None when not loaded
+        self._listeners = []
+        # _snapshot_files() of the snapshot the current state was mapped from or written to
+        self._snapshot = None
+
+    def add_listener(self, callback):
+        """Call `callback()` after every change made through this gallery and every invalidation"""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[GALLERY] Change listener failed: {e}")
+
+    def _empty_state(self):
+        return np.empty((0, 0), dtype=np.float32), [], [], ExactIndex()
+
+    def _load_snapshot(self, version):
+        """Map the on-disk snapshot if it was written for the current gallery version"""
+        if version is None:
+            return None
+        files = _snapshot_files()
+        try:
+            with open(SNAPSHOT_META_PATH) as f:
+                meta = json.load(f)
+            if meta.get('version') != version:
+                return None
+            shape = (len(meta['ids']), meta['dim'])
+            if shape[0] == 0:
+                matrix = np.empty(shape, dtype=np.float32)
+            else:
+                # Removals leave unused rows at the end of the file, so it may be longer
+                matrix = np.memmap(SNAPSHOT_PATH, dtype=np.float32, mode='r', shape=shape)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        self._snapshot = files
+        return matrix, meta['ids'], meta['names']
+
+    def _save_meta(self, suffix, version, ids, names, dim):
+        with open(SNAPSHOT_META_PATH + suffix, 'w') as f:
+            json.dump({'version': version, 'dim': dim, 'ids': ids, 'names': names}, f)
+        os.replace(SNAPSHOT_META_PATH + suffix, SNAPSHOT_META_PATH)
+
+    def _save_snapshot(self, version, ids, names, dim, fill):
+        """Write a new snapshot whose rows `fill(rows)` writes straight into the mapped
+        file, so copying rows out of the current snapshot stays in the page cache"""
+        if version is None:
+            return
+        # Several processes may write the same snapshot, so each uses its own temp file
+        suffix = f".{os.getpid()}.tmp"
+        try:
+            if ids:
+                rows = np.memmap(SNAPSHOT_PATH + suffix, dtype=np.float32, mode='w+', shape=(len(ids), dim))
+                fill(rows)
+                rows.flush()
+                del rows
+            else:
+                open(SNAPSHOT_PATH + suffix, 'wb').close()
+            os.replace(SNAPSHOT_PATH + suffix, SNAPSHOT_PATH)
+            self._save_meta(suffix, version, ids, names, dim)
+        except (OSError, ValueError) as e:
+            print(f"[GALLERY] Could not write snapshot: {e}")
+
+    def _patch_snapshot(self, version, ids, names, dim, changes):
+        """Write only the `changes` ({row: vector}) into the snapshot this gallery
+        mapped, then its metadata. Returns False when the files on disk are not
+        that snapshot any more, e.g. another process rewrote them."""
+        if version is None or self._snapshot is None or self._snapshot != _snapshot_files():
+            return False
+        suffix = f".{os.getpid()}.tmp"
+        try:
+            if changes:
+                with open(SNAPSHOT_PATH, 'r+b') as f:
+                    for row, vector in sorted(changes.items()):
+                        f.seek(row * dim * 4)
+                        f.write(np.asarray(vector, dtype=np.float32).tobytes())
+            self._save_meta(suffix, version, ids, names, dim)
+        except OSError as e:
+            print(f"[GALLERY] Could not patch snapshot: {e}")
+            return False
+        return True
+
+    def _load_state(self):
+        version = get_gallery_version()
+        snapshot = self._load_snapshot(version)
+        if snapshot is not None:
+            matrix, ids, names = snapshot
+            print(f"[GALLERY] Mapped {len(ids)} face embeddings from snapshot")
+        else:
+            rows = get_all_face_embedding_rows()
+            if not rows:
+                # Replaces a snapshot left over from earlier employees
+                self._save_snapshot(version, [], [], 0, None)
+                return self._empty_state()
+            ids = [row[0] for row in rows]
+            names = [row[1] for row in rows]
+            matrix = np.ascontiguousarray(np.vstack([normalize_embedding(row[2]) for row in rows]))
+            print(f"[GALLERY] Loaded {len(ids)} face embeddings from database")
+            self._save_snapshot(version, ids, names, matrix.shape[1], lambda rows: np.copyto(rows, matrix))
+            # Prefer the mapped copy so full-precision rows live in the shared page cache
+            snapshot = self._load_snapshot(version)
+            if snapshot is not None:
+                matrix = snapshot[0]
+        if not ids:
+            return self._empty_state()
+        return matrix, ids, names, build_index(matrix, ids, version)
+
+    def _get_state(self):
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = self._load_state()
+                state = self._state
+        return state
+
+    def preload(self):
+        """Load the gallery now instead of on the first match"""
+        self._get_state()
+
+    def reload(self):
+        """Rebuild the gallery from the database"""
+        with self._lock:
+            self._state = self._load_state()
+
+    def invalidate(self):
+        """Drop the in-memory gallery; it is reloaded on the next match"""
+        with self._lock:
+            self._state = None
+        self._notify()
+
+    def upsert(self, employee_id, name, embedding):
+        """Add or replace the embedding of one employee"""
+        self._upsert(employee_id, name, embedding)
+        self._notify()
+
+    def rename(self, employee_id, name):
+        """Update the display name stored for an employee"""
+        if self._rename(employee_id, name):
+            self._notify()
+
+    def remove(self, employee_id):
+        """Remove an employee from the gallery"""
+        self._remove(employee_id)
+        self._notify()
+
+    def _upsert(self, employee_id, name, embedding):
+        vector = normalize_embedding(embedding)
+        with self._lock:
+            if self._state is None:
+                return  # Will be picked up by the next full load
+            matrix, ids, names, index = self._state
+            if len(ids) and matrix.shape[1] != vector.shape[0]:
+                self._state = None
+                return
+            ids, names = list(ids), list(names)
+            if employee_id in ids:
+                row = ids.index(employee_id)
+                names[row] = name
+                index = index.update(row, vector)
+            else:
+                row = len(ids)
+                ids.append(employee_id)
+                names.append(name)
+                index = index.add(row, vector)
+            self._publish(matrix, ids, names, index, vector.shape[0], {row: vector})
+
+    def _publish(self, matrix, ids, names, index, dim, changes):
+        """Install the state left by an incremental change and write it out first.
+        Listeners run after this, so recognition workers told about the change
+        only re-map the snapshot and load the index instead of reading every row
+        from the database (and retraining the IVF index) themselves.
+
+        `changes` ({row: vector}) are the only rows that differ from `matrix`.
+        They are patched into the current snapshot file, which rows are appended
+        to and never cut from, so an edit costs I/O for its own rows only; the
+        snapshot is rewritten whole only when the file on disk isn't ours.
+        """
+        def fill(rows):
+            kept = min(len(rows), len(matrix))
+            if kept:
+                np.copyto(rows[:kept], matrix[:kept])
+            for row, vector in changes.items():
+                rows[row] = vector
+
+        version = get_gallery_version()
+        index.save(ids, version)
+        if not self._patch_snapshot(version, ids, names, dim, changes):
+            self._save_snapshot(version, ids, names, dim, fill)
+        snapshot = self._load_snapshot(version)
+        if snapshot is not None:
+            new_matrix = snapshot[0]
+        else:
+            new_matrix = np.empty((len(ids), dim), dtype=np.float32)
+            fill(new_matrix)
+        self._state = (new_matrix, ids, names, index)
+
+    def _rename(self, employee_id, name):
+        with self._lock:
+            if self._state is None:
+                return False
+            matrix, ids, names, index = self._state
+            if employee_id not in ids:
+                return False
+            row = ids.index(employee_id)
+            if names[row] == name:
+                return False  # Other profile fields changed; the gallery didn't
+            names = list(names)
+            names[row] = name
+            # Only the metadata changes: the rows file stays as it is
+            self._publish(matrix, ids, names, index, matrix.shape[1], {})
+            return True
+
+    def _remove(self, employee_id):
+        with self._lock:
+            if self._state is None:
+                return
+            matrix, ids, names, index = self._state
+            if employee_id not in ids:
+                return
+            # Move the last row into the freed slot so only one row changes position
+            row, last_row = ids.index(employee_id), len(ids) - 1
+            ids, names = list(ids[:-1]), list(names[:-1])
+            changes = {}
+            if row != last_row:
+                ids[row] = self._state[1][last_row]
+                names[row] = self._state[2][last_row]
+                changes[row] = np.array(matrix[last_row])
+            index = index.remove(row, last_row) if ids else ExactIndex()
+            self._publish(matrix, ids, names, index, matrix.shape[1], changes)
+
+    def match(self, embedding):
+        """Return (employee_id, name, score) of the closest enrolled face, or None if empty"""
+        match = self.match_with_vector(embedding)
+        return None if match is None else match[:3]
+
+    def match_with_vector(self, embedding):
+        """Like match, plus a copy of the matched normalized embedding: (employee_id, name, score, vector)"""
+        matrix, ids, names, index = self._get_state()
+        if not ids:
+            return None
+        query = normalize_embedding(embedding)
+        rows = index.candidates(query)
+        if rows is None or len(rows) == 0:
+            scores = matrix @ query
+            best_row = int(np.argmax(scores))
+            best_score = scores[best_row]
+        else:
+            scores = matrix[rows] @ query
+            best = int(np.argmax(scores))
+            best_row, best_score = int(rows[best]), scores[best]
+        return ids[best_row], names[best_row], float(best_score), np.array(matrix[best_row])
+
+    def __len__(self):
+        return len(self._get_state()[1])
+
+
+# Shared by the recognition and registration paths of this process
+gallery = FaceGallery()
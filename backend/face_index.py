@@ -0,0 +1,329 @@
+# face_index.py
+
+import os
+import hashlib
+import numpy as np
+from database import DB_NAME
+
+# 'exact' scans every enrolled face, 'ivf' probes only the closest clusters
+FACE_INDEX = os.environ.get('FACE_INDEX', 'exact')
+# Below this many faces the exact scan is already fast enough
+IVF_MIN_GALLERY_SIZE = int(os.environ.get('FACE_INDEX_MIN_SIZE', 5000))
+IVF_NPROBE = int(os.environ.get('FACE_INDEX_NPROBE', 8))
+# 'none', 'int8' (per-vector scale) or 'float16' coarse codes, re-scored exactly
+FACE_QUANTIZATION = os.environ.get('FACE_QUANTIZATION', 'none')
+QUANTIZED_RESCORE_K = int(os.environ.get('FACE_QUANTIZATION_RESCORE_K', 16))
+# Persisted next to attendance.db so restarts don't have to retrain
+INDEX_PATH = os.path.join(os.path.dirname(DB_NAME), "face_index.npz")
+
+_CHUNK_ROWS = 16384
+# Codes are widened this many rows at a time, into a buffer small enough to stay in L2
+_COARSE_BLOCK_ROWS = 256
+# Sign bit plus the exponent and mantissa of a float16 shifted left by 13 (0x8FFFE000)
+_FLOAT16_BITS = np.int32(-0x70002000)
+_FLOAT16_RESCALE = np.float32(2.0 ** 112)
+
+
+def _ids_fingerprint(ids):
+    return hashlib.sha1("\n".join(str(i) for i in ids).encode()).hexdigest()
+
+
+def _nearest_centroids(matrix, centroids):
+    """Assign every row to its closest centroid, in chunks to bound memory"""
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), _CHUNK_ROWS):
+        chunk = matrix[start:start + _CHUNK_ROWS]
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def kmeans(matrix, nlist, iterations=10, seed=0):
+    """Spherical k-means over normalized rows, returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), nlist * 256)
+    sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        # Re-seed empty clusters with random sample points
+        empty = np.nonzero(counts == 0)[0]
+        sums[empty] = sample[rng.choice(sample_size, len(empty))]
+        centroids = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+    return centroids.astype(np.float32)
+
+
+class ExactIndex:
+    """Brute-force scan over every row of the gallery"""
+    kind = "exact"
+
+    def candidates(self, query):
+        return None  # None means "all rows"
+
+    def bytes_per_identity(self):
+        return 0
+
+    def add(self, row, vector):
+        return self
+
+    def update(self, row, vector):
+        return self
+
+    def remove(self, row, last_row):
+        return self
+
+    def save(self, ids, version):
+        pass
+
+
+class IVFFlatIndex:
+    """Inverted-file index: rows are bucketed by their closest k-means centroid
+    and a query only scans the `nprobe` closest buckets.
+
+    Buckets hold gallery row positions, the vectors themselves stay in the
+    gallery matrix. Mutations return a new index so that readers holding the
+    previous one are never affected.
+    """
+    kind = "ivf"
+
+    def __init__(self, centroids, assignments, lists=None, nprobe=IVF_NPROBE):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.nprobe = min(nprobe, len(centroids))
+        if lists is None:
+            order = np.argsort(assignments, kind='stable').astype(np.int32)
+            counts = np.bincount(assignments, minlength=len(centroids))
+            lists = tuple(np.split(order, np.cumsum(counts)[:-1]))
+        self.lists = lists
+
+    @classmethod
+    def train(cls, matrix, nlist=None, nprobe=IVF_NPROBE):
+        nlist = nlist or max(1, int(np.sqrt(len(matrix))))
+        centroids = kmeans(matrix, min(nlist, len(matrix)))
+        print(f"[INDEX] Trained IVF index with {len(centroids)} lists over {len(matrix)} faces")
+        return cls(centroids, _nearest_centroids(matrix, centroids), nprobe=nprobe)
+
+    @classmethod
+    def load(cls, matrix, ids, version, path=None, nprobe=IVF_NPROBE):
+        """Load a persisted index (from INDEX_PATH by default), or None if missing
+        or built for other ids. Lists saved at another gallery version may point at
+        changed vectors, so the rows are then reassigned to the saved centroids."""
+        path = path or INDEX_PATH
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data['fingerprint']) != _ids_fingerprint(ids):
+                    return None
+                centroids = data['centroids']
+                if version is not None and 'version' in data.files and str(data['version']) == str(version):
+                    return cls(centroids, data['assignments'], nprobe=nprobe)
+        except Exception as e:
+            print(f"[INDEX] Could not load {path}: {e}")
+            return None
+        if centroids.shape[1] != matrix.shape[1]:
+            return None
+        print(f"[INDEX] Saved index is from another gallery version, reassigning {len(matrix)} faces")
+        index = cls(centroids, _nearest_centroids(matrix, centroids), nprobe=nprobe)
+        index.save(ids, version, path)
+        return index
+
+    def save(self, ids, version, path=None):
+        path = path or INDEX_PATH
+        try:
+            tmp_path = path + ".tmp.npz"
+            np.savez(tmp_path, centroids=self.centroids, assignments=self.assignments,
+                     fingerprint=np.array(_ids_fingerprint(ids)), version=np.array(str(version)))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[INDEX] Could not save {path}: {e}")
+
+    def bytes_per_identity(self):
+        return self.assignments.itemsize + self.lists[0].itemsize
+
+    def _closest_list(self, vector):
+        return int(np.argmax(self.centroids @ vector))
+
+    def _with(self, assignments, changes):
+        lists = list(self.lists)
+        for list_id, values in changes.items():
+            lists[list_id] = values
+        return IVFFlatIndex(self.centroids, assignments, tuple(lists), self.nprobe)
+
+    def candidates(self, query):
+        scores = self.centroids @ query
+        if self.nprobe < len(scores):
+            probe = np.argpartition(-scores, self.nprobe - 1)[:self.nprobe]
+        else:
+            probe = range(len(scores))
+        return np.concatenate([self.lists[c] for c in probe])
+
+    def add(self, row, vector):
+        """Index a new row appended at the end of the gallery"""
+        list_id = self._closest_list(vector)
+        assignments = np.append(self.assignments, np.int32(list_id))
+        return self._with(assignments, {list_id: np.append(self.lists[list_id], np.int32(row))})
+
+    def update(self, row, vector):
+        """Re-bucket a row whose vector was replaced"""
+        old_list, new_list = int(self.assignments[row]), self._closest_list(vector)
+        if old_list == new_list:
+            return self
+        assignments = self.assignments.copy()
+        assignments[row] = new_list
+        return self._with(assignments, {
+            old_list: self.lists[old_list][self.lists[old_list] != row],
+            new_list: np.append(self.lists[new_list], np.int32(row)),
+        })
+
+    def remove(self, row, last_row):
+        """Drop `row`; the gallery moved `last_row` into its slot"""
+        removed_list, moved_list = int(self.assignments[row]), int(self.assignments[last_row])
+        changes = {removed_list: self.lists[removed_list][self.lists[removed_list] != row]}
+        if row != last_row:
+            moved = changes.get(moved_list, self.lists[moved_list]).copy()
+            moved[moved == last_row] = row
+            changes[moved_list] = moved
+        assignments = self.assignments[:-1].copy()
+        if row != last_row:
+            assignments[row] = moved_list
+        return self._with(assignments, changes)
+
+
+def quantize(matrix, mode):
+    """Encode normalized rows as int8 codes with per-row scales, or as float16.
+    Rows are encoded in chunks so a mapped gallery is never copied whole."""
+    matrix = np.atleast_2d(matrix)
+    codes = np.empty(matrix.shape, dtype=np.float16 if mode == 'float16' else np.int8)
+    scales = None if mode == 'float16' else np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), _CHUNK_ROWS):
+        chunk = np.asarray(matrix[start:start + _CHUNK_ROWS], dtype=np.float32)
+        end = start + len(chunk)
+        if scales is None:
+            block = chunk.astype(np.float16)
+            # Flushing subnormals lets coarse_scores widen the codes with integer ops alone
+            block[np.abs(block) < np.finfo(np.float16).tiny] = 0
+            codes[start:end] = block
+        else:
+            chunk_scales = np.abs(chunk).max(axis=1) / 127.0
+            chunk_scales[chunk_scales == 0] = 1.0
+            scales[start:end] = chunk_scales
+            codes[start:end] = np.round(chunk / chunk_scales[:, None])
+    return codes, scales
+
+
+def coarse_scores(codes, scales, query):
+    """Approximate dot products of the coded rows with a query.
+    Codes are widened to float32 a block at a time into one buffer that stays
+    in cache, so the scan reads only the compact codes from memory and never
+    materializes a full-precision copy of the gallery."""
+    scores = np.empty(len(codes), dtype=np.float32)
+    half = codes.dtype == np.float16
+    block = np.empty((min(len(codes), _COARSE_BLOCK_ROWS), codes.shape[1]), dtype=np.int32 if half else np.float32)
+    if half:
+        # numpy widens float16 in scalar code; moving the bits into float32 position
+        # instead is exact and much faster, but yields the value times 2**-112
+        query = query * _FLOAT16_RESCALE
+    for start in range(0, len(codes), _COARSE_BLOCK_ROWS):
+        chunk = codes[start:start + _COARSE_BLOCK_ROWS]
+        rows = block[:len(chunk)]
+        if half:
+            np.copyto(rows, chunk.view(np.int16))
+            np.left_shift(rows, 13, out=rows)
+            np.bitwise_and(rows, _FLOAT16_BITS, out=rows)
+            rows = rows.view(np.float32)
+        else:
+            np.copyto(rows, chunk)
+        np.dot(rows, query, out=scores[start:start + len(chunk)])
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+class QuantizedIndex:
+    """Coarse pass over compact codes of every candidate row, returning only
+    the top `rescore_k` rows so the gallery re-scores them at full precision.
+
+    Wraps another index (exact or IVF) that picks the candidate rows.
+    """
+
+    def __init__(self, inner, mode, codes, scales, rescore_k=QUANTIZED_RESCORE_K):
+        self.inner = inner
+        self.mode = mode
+        self.codes = codes
+        self.scales = scales
+        self.rescore_k = rescore_k
+        self.kind = f"{inner.kind}+{mode}"
+
+    @classmethod
+    def build(cls, inner, matrix, mode, rescore_k=QUANTIZED_RESCORE_K):
+        codes, scales = quantize(matrix, mode)
+        return cls(inner, mode, codes, scales, rescore_k)
+
+    def bytes_per_identity(self):
+        code_bytes = self.codes.shape[1] * self.codes.itemsize + (4 if self.scales is not None else 0)
+        return code_bytes + self.inner.bytes_per_identity()
+
+    def candidates(self, query):
+        rows = self.inner.candidates(query)
+        if rows is None:
+            scores = coarse_scores(self.codes, self.scales, query)
+        else:
+            scores = coarse_scores(self.codes[rows], None if self.scales is None else self.scales[rows], query)
+        if len(scores) > self.rescore_k:
+            top = np.argpartition(-scores, self.rescore_k - 1)[:self.rescore_k]
+        else:
+            top = np.arange(len(scores))
+        return top if rows is None else rows[top]
+
+    def _with(self, inner, codes, scales):
+        return QuantizedIndex(inner, self.mode, codes, scales, self.rescore_k)
+
+    def add(self, row, vector):
+        code, scale = quantize(vector, self.mode)
+        scales = None if self.scales is None else np.append(self.scales, scale)
+        return self._with(self.inner.add(row, vector), np.vstack([self.codes, code]), scales)
+
+    def update(self, row, vector):
+        code, scale = quantize(vector, self.mode)
+        codes = self.codes.copy()
+        codes[row] = code[0]
+        scales = None
+        if self.scales is not None:
+            scales = self.scales.copy()
+            scales[row] = scale[0]
+        return self._with(self.inner.update(row, vector), codes, scales)
+
+    def remove(self, row, last_row):
+        codes = self.codes[:-1].copy()
+        scales = None if self.scales is None else self.scales[:-1].copy()
+        if row != last_row:
+            codes[row] = self.codes[last_row]
+            if scales is not None:
+                scales[row] = self.scales[last_row]
+        return self._with(self.inner.remove(row, last_row), codes, scales)
+
+    def save(self, ids, version):
+        self.inner.save(ids, version)
+
+
+def bytes_per_identity(matrix, index):
+    """Memory held per enrolled face: its full-precision gallery row, which every mode
+    keeps for exact scoring, plus what the index stores on top of it"""
+    return matrix.shape[1] * matrix.itemsize + index.bytes_per_identity()
+
+
+def build_index(matrix, ids, version):
+    """Pick the configured index for a freshly loaded gallery at `version`"""
+    if FACE_INDEX != 'ivf' or len(ids) < IVF_MIN_GALLERY_SIZE:
+        index = ExactIndex()
+    else:
+        index = IVFFlatIndex.load(matrix, ids, version)
+        if index is None:
+            index = IVFFlatIndex.train(matrix)
+            index.save(ids, version)
+    if FACE_QUANTIZATION in ('int8', 'float16'):
+        index = QuantizedIndex.build(index, matrix, FACE_QUANTIZATION)
+    return index
@@ -0,0 +1,91 @@
+# face_pipeline.py
+
+import cv2
+import numpy as np
+import model_registry
+from model_registry import get_face_analysis
+from inference_scheduler import embedding_batcher
+
+
+def detect_faces(image):
+    """Detect faces without embedding them, returns (bboxes, kpss) sorted by detection score.
+    In fast mode smaller detection sizes are tried first and larger ones only on a miss."""
+    det_model = get_face_analysis().det_model
+    sizes = model_registry.DETECTION_SIZES if model_registry.PIPELINE_MODE == 'fast' else [None]
+    for size in sizes:
+        bboxes, kpss = det_model.detect(image, input_size=size, max_num=0, metric='default')
+        if bboxes.shape[0] > 0:
+            break
+    return bboxes, kpss
+
+
+# Extra context kept around a MediaPipe box, as a fraction of its size, before InsightFace re-detects in it
+FACE_CROP_MARGIN = 0.5
+
+
+def crop_to_box(image, box, margin=FACE_CROP_MARGIN):
+    """Region of `image` around an (x1, y1, x2, y2, ...) face box, widened by `margin` on every side"""
+    x1, y1, x2, y2 = [int(v) for v in box[:4]]
+    pad_x, pad_y = int((x2 - x1) * margin), int((y2 - y1) * margin)
+    height, width = image.shape[:2]
+    return image[max(0, y1 - pad_y):min(height, y2 + pad_y), max(0, x1 - pad_x):min(width, x2 + pad_x)]
+
+
+def align_face(image, kps):
+    """Warp a detected face to the 112x112 crop expected by the recognition model"""
+    from insightface.utils import face_align
+    return face_align.norm_crop(image, landmark=kps, image_size=112)
+
+
+def augmented_crops(image, kps, augmentations):
+    """Aligned 112x112 crops of one detected face under (angle, scale, flip) augmentations.
+    Each augmentation is folded into the alignment transform, so every crop is
+    sampled straight from the original image without black borders."""
+    from insightface.utils import face_align
+    align = np.vstack([face_align.estimate_norm(kps, image_size=112), [0, 0, 1]])
+    crops = []
+    for angle, scale, flip in augmentations:
+        augment = np.vstack([cv2.getRotationMatrix2D((56, 56), angle, scale), [0, 0, 1]])
+        crop = cv2.warpAffine(image, (augment @ align)[:2], (112, 112), borderValue=0.0)
+        crops.append(np.ascontiguousarray(crop[:, ::-1]) if flip else crop)
+    return crops
+
+
+def embed_crops(crops):
+    """Embed aligned face crops, batched together with concurrent requests"""
+    return embedding_batcher.embed(crops)
+
+
+def get_faces(image, limit=None):
+    """Drop-in replacement for FaceAnalysis.get.
+
+    In 'full' mode this is exactly FaceAnalysis.get. In 'fast' mode detection
+    is adaptive and only the best `limit` faces are aligned and embedded,
+    through the micro-batching scheduler.
+    """
+    face_analysis = get_face_analysis()
+    if model_registry.PIPELINE_MODE != 'fast':
+        faces = face_analysis.get(image)
+        return faces[:limit] if limit else faces
+
+    faces = locate_faces(image, limit)
+    embed_faces(image, faces)
+    return faces
+
+
+def locate_faces(image, limit=None):
+    """Detected faces (bbox, kps, det_score) without embeddings, best first"""
+    from insightface.app.common import Face
+
+    bboxes, kpss = detect_faces(image)
+    count = bboxes.shape[0] if not limit else min(limit, bboxes.shape[0])
+    return [Face(bbox=bboxes[i, 0:4], kps=kpss[i], det_score=bboxes[i, 4]) for i in range(count)]
+
+
+def embed_faces(image, faces):
+    """Align and embed located faces in place, as one batch"""
+    if faces:
+        embeddings = embed_crops([align_face(image, face.kps) for face in faces])
+        for face, embedding in zip(faces, embeddings):
+            face.embedding = embedding
+    return faces
@@ -0,0 +1,125 @@
+# frame_gate.py
+
+import os
+import time
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Set to 0 to run recognition on every frame
+FRAME_GATE_ENABLED = os.environ.get('FRAME_GATE', '1') == '1'
+# A thumbnail cell counts as changed when its gray level moves by more than this (0-255)
+FRAME_GATE_PIXEL_DELTA = int(os.environ.get('FRAME_GATE_PIXEL_DELTA', 12))
+# A frame is unchanged when fewer than this fraction of its cells changed
+FRAME_GATE_CHANGED_FRACTION = float(os.environ.get('FRAME_GATE_CHANGED_FRACTION', 0.01))
+# Recognition runs at least this often per kiosk even on a static scene
+FRAME_GATE_MAX_SKIP_S = float(os.environ.get('FRAME_GATE_MAX_SKIP_S', 30))
+# Kiosks remembered by the /mark_attendance gate
+FRAME_GATE_MAX_KIOSKS = int(os.environ.get('FRAME_GATE_MAX_KIOSKS', 256))
+
+THUMBNAIL_SIZE = (32, 24)
+# Only outcomes of a completed recognition are replayed for unchanged frames; "Liveness Unavailable"
+# (check timed out or failed) is left out on purpose so a person standing still gets rechecked
+CACHEABLE_STATUSES = {"No Face", "Unknown", "Spoof", "Success", "Already Marked", "Already Punched Out"}
+
+# Frames checked and recognitions skipped, over every kiosk and stream
+gate_stats = {"frames": 0, "skipped": 0, "skipped_empty": 0}
+_gate_stats_lock = threading.Lock()
+# Bumped when enrollment changes the gallery, so cached results of earlier frames are not replayed
+_generation = 0
+
+
+def _count(**increments):
+    with _gate_stats_lock:
+        for name, value in increments.items():
+            gate_stats[name] += value
+
+
+def invalidate():
+    """Forget every cached result, e.g. after someone was enrolled or removed"""
+    global _generation
+    _generation += 1
+
+
+def thumbnail(contents):
+    """Tiny grayscale version of an encoded frame. JPEGs are decoded at 1/8 scale,
+    so this costs a fraction of a full decode."""
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    return cv2.resize(image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class FrameChangeDetector:
+    """Remembers the last frame that went through recognition for one camera,
+    and the result it produced"""
+
+    def __init__(self):
+        self.reference = None
+        self.reference_at = 0.0
+        self.generation = _generation
+        self.result = None
+
+    def cached_result(self, thumb, now):
+        """The previous result if `thumb` shows the same scene, otherwise None"""
+        if (self.reference is None or thumb is None or self.generation != _generation
+                or now - self.reference_at > FRAME_GATE_MAX_SKIP_S):
+            return None
+        changed = np.count_nonzero(np.abs(thumb - self.reference) > FRAME_GATE_PIXEL_DELTA)
+        if changed >= FRAME_GATE_CHANGED_FRACTION * thumb.size:
+            return None
+        return self.result
+
+    def update(self, thumb, result):
+        if thumb is None or result.get("status") not in CACHEABLE_STATUSES:
+            self.reference = None
+            return
+        self.reference, self.reference_at, self.result = thumb, time.monotonic(), result
+        self.generation = _generation
+
+    def check(self, contents):
+        """(thumbnail, cached result or None) for an incoming frame"""
+        _count(frames=1)
+        if not FRAME_GATE_ENABLED:
+            return None, None
+        thumb = thumbnail(contents)
+        cached = self.cached_result(thumb, time.monotonic())
+        if cached is not None:
+            _count(skipped=1, skipped_empty=int(cached.get("status") == "No Face"))
+            cached = dict(cached)
+        return thumb, cached
+
+
+class FrameGate:
+    """Per-kiosk frame change detectors for /mark_attendance, least recently seen kiosks evicted first"""
+
+    def __init__(self, max_kiosks=FRAME_GATE_MAX_KIOSKS):
+        self.max_kiosks = max_kiosks
+        self._detectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _detector(self, kiosk):
+        with self._lock:
+            detector = self._detectors.get(kiosk)
+            if detector is None:
+                detector = self._detectors[kiosk] = FrameChangeDetector()
+                if len(self._detectors) > self.max_kiosks:
+                    self._detectors.popitem(last=False)
+            self._detectors.move_to_end(kiosk)
+            return detector
+
+    def check(self, kiosk, contents):
+        return self._detector(kiosk).check(contents)
+
+    def update(self, kiosk, thumb, result):
+        if FRAME_GATE_ENABLED:
+            self._detector(kiosk).update(thumb, result)
+
+    def forget(self, kiosk):
+        """Drop the cached result of one kiosk, e.g. after attendance changed outside recognition"""
+        with self._lock:
+            self._detectors.pop(kiosk, None)
+
+
+frame_gate = FrameGate()
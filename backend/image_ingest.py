@@ -0,0 +1,117 @@
+# image_ingest.py
+
+import os
+import time
+import struct
+import threading
+from collections import deque
+import cv2
+import numpy as np
+
+# Smallest long side a reduced JPEG decode may produce; detection runs at 640 and
+# alignment samples the 112x112 crop from this resolution
+INGEST_TARGET_SIDE = int(os.environ.get('INGEST_TARGET_SIDE', 960))
+# Frames with more pixels than this after decoding are downscaled before any model sees them
+INGEST_MAX_PIXELS = int(os.environ.get('INGEST_MAX_PIXELS', 1920 * 1080))
+
+# libjpeg can decode directly at 1/2, 1/4 and 1/8 scale
+_REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+# Start-of-frame markers carry the image size; C4 (DHT), C8 (JPG) and CC (DAC) don't
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG header without decoding it, or None if `data` isn't a JPEG"""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        if marker in (0xD9, 0xDA):  # end of image / start of scan before any frame header
+            return None
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+
+class IngestStats:
+    """Decode time and decoded frame size of uploads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._decode_ms = deque(maxlen=1000)
+        self.decodes = 0
+        self.reduced = 0
+        self.downscaled = 0
+        self.peak_source_mb = 0.0
+        self.peak_decoded_mb = 0.0
+
+    def record(self, decode_ms, source_bytes, decoded_bytes, factor, downscaled):
+        with self._lock:
+            self._decode_ms.append(decode_ms)
+            self.decodes += 1
+            self.reduced += int(factor > 1)
+            self.downscaled += int(downscaled)
+            self.peak_source_mb = max(self.peak_source_mb, source_bytes / (1024 * 1024))
+            self.peak_decoded_mb = max(self.peak_decoded_mb, decoded_bytes / (1024 * 1024))
+
+    def stats(self):
+        with self._lock:
+            timings = sorted(self._decode_ms)
+            return {
+                "decodes": self.decodes,
+                "reduced_decodes": self.reduced,
+                "downscaled": self.downscaled,
+                "decode_ms_mean": round(sum(timings) / len(timings), 2) if timings else 0,
+                "decode_ms_p99": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 2) if timings else 0,
+                # Size a full-resolution decode would have needed vs. what was actually allocated
+                "peak_full_decode_mb": round(self.peak_source_mb, 1),
+                "peak_decoded_mb": round(self.peak_decoded_mb, 1),
+            }
+
+
+ingest_stats = IngestStats()
+
+
+def decode_upload(contents, target_side=INGEST_TARGET_SIDE, max_pixels=INGEST_MAX_PIXELS):
+    """Decode an uploaded image to BGR at no more resolution than the models need.
+
+    Large JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale, so a 12MP
+    upload never materializes at full size. Returns (image, scale) where
+    scale is decoded width / original width, or (None, 1.0) for invalid data.
+    """
+    start = time.perf_counter()
+    buffer = np.frombuffer(contents, np.uint8)
+    size = jpeg_size(contents)
+    factor, flag = 1, cv2.IMREAD_COLOR
+    if size is not None:
+        for candidate, candidate_flag in _REDUCED_FLAGS:
+            if max(size) // candidate >= target_side:
+                factor, flag = candidate, candidate_flag
+                break
+    image = cv2.imdecode(buffer, flag)
+    if image is None:
+        return None, 1.0
+
+    downscaled = False
+    height, width = image.shape[:2]
+    if height * width > max_pixels:
+        shrink = (max_pixels / (height * width)) ** 0.5
+        image = cv2.resize(image, (max(1, int(width * shrink)), max(1, int(height * shrink))), interpolation=cv2.INTER_AREA)
+        downscaled = True
+
+    source_width, source_height = size if size is not None else (width, height)
+    ingest_stats.record((time.perf_counter() - start) * 1000, source_width * source_height * 3,
+                        image.nbytes, factor, downscaled)
+    # EXIF rotation may swap the axes, so compare the long sides
+    return image, max(image.shape[:2]) / max(source_width, source_height)
@@ -0,0 +1,115 @@
+# inference_executor.py
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from inference_scheduler import MAX_BATCH_SIZE
+from recognition_workers import RECOGNITION_PROCESSES
+
+
+def default_workers():
+    """Enough concurrent frames to keep every recognition process busy, or, in-process,
+    to fill an embedding batch (bounded by the cores detection can run on)"""
+    if RECOGNITION_PROCESSES > 0:
+        # One frame per process in flight plus one whose attendance is being marked
+        return 2 * RECOGNITION_PROCESSES
+    return max(2, min(MAX_BATCH_SIZE, 2 * (os.cpu_count() or 1)))
+
+
+# Threads running face recognition for kiosk requests, separate from the
+# threadpool FastAPI uses for the regular (admin) endpoints
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0)) or default_workers()
+# Requests allowed to wait for a worker before new ones are turned away
+INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', 16))
+# Seconds a rejected kiosk should wait before retrying
+INFERENCE_RETRY_AFTER = int(os.environ.get('INFERENCE_RETRY_AFTER', 1))
+
+
+class InferenceQueueFull(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+class InferenceExecutor:
+    """Bounded executor for CPU-bound recognition work.
+
+    At most `workers` jobs run at once and at most `queue_size` more wait;
+    anything beyond that is rejected immediately so callers can answer
+    with Retry-After instead of piling up latency.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, queue_size=INFERENCE_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._waits_ms = deque(maxlen=1000)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def _record_start(self, wait_ms):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._waits_ms.append(wait_ms)
+
+    def _record_end(self):
+        with self._lock:
+            self.running -= 1
+            self.completed += 1
+
+    def _release_cancelled(self, future):
+        # A job cancelled while still queued never runs, so its slot is released here instead
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+                self.cancelled += 1
+            self._slots.release()
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on an inference worker, raising InferenceQueueFull when saturated"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise InferenceQueueFull()
+        with self._lock:
+            self.queued += 1
+        enqueued_at = time.perf_counter()
+
+        def job():
+            self._record_start((time.perf_counter() - enqueued_at) * 1000)
+            try:
+                return fn(*args)
+            finally:
+                self._record_end()
+                # Released here rather than in run() so a disconnected client can't free a slot early
+                self._slots.release()
+
+        future = self._pool.submit(job)
+        future.add_done_callback(self._release_cancelled)
+        # Cancelling the awaiting task (client gone) cancels the job if it hasn't started
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "wait_ms_mean": round(sum(waits) / len(waits), 2) if waits else 0,
+                "wait_ms_p99": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))], 2) if waits else 0,
+            }
+
+
+inference_executor = InferenceExecutor()
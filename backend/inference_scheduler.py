@@ -0,0 +1,97 @@
+# inference_scheduler.py
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+from model_registry import get_face_analysis
+
+# How long the scheduler waits for more crops after the first one arrives (0 disables batching)
+BATCH_WINDOW_MS = float(os.environ.get('FACE_BATCH_WINDOW_MS', 5))
+MAX_BATCH_SIZE = int(os.environ.get('FACE_MAX_BATCH_SIZE', 32))
+
+
+def _run_recognition(crops):
+    """Embed a list of aligned face crops in a single recognition model call"""
+    rec_model = get_face_analysis().models['recognition']
+    return rec_model.get_feat(crops)
+
+
+class EmbeddingBatcher:
+    """Collects aligned face crops from concurrent requests within a short
+    window and runs the recognition model on them as one batch, then hands
+    every caller its own embeddings back.
+    """
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE):
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.crops = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def embed(self, crops):
+        """Return an (n, dim) array of embeddings for `crops`, blocking until its batch has run"""
+        if self.window <= 0:
+            self.batches += 1
+            self.crops += len(crops)
+            return _run_recognition(list(crops))
+        self._ensure_started()
+        future = Future()
+        self._queue.put((list(crops), future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            crops = [crop for item_crops, _ in batch for crop in item_crops]
+            try:
+                embeddings = _run_recognition(crops)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.crops += len(crops)
+            offset = 0
+            for item_crops, future in batch:
+                future.set_result(np.asarray(embeddings[offset:offset + len(item_crops)]))
+                offset += len(item_crops)
+
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000,
+            "batches": self.batches,
+            "crops": self.crops,
+            "mean_batch_size": round(self.crops / self.batches, 2) if self.batches else 0,
+        }
+
+
+embedding_batcher = EmbeddingBatcher()
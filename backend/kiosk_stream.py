@@ -0,0 +1,156 @@
+# kiosk_stream.py
+
+import os
+import time
+import itertools
+import threading
+from face_pipeline import locate_faces, embed_faces
+from frame_gate import FrameChangeDetector
+from recognize_module import decode_frame, identify_face, process_attendance, attendance_outcome_resets, SPOOF_RESULT, UNKNOWN_RESULT, LIVENESS_UNAVAILABLE_RESULT
+
+# A detection continues a track when its box overlaps the track's last box at least this much
+TRACK_IOU_THRESHOLD = float(os.environ.get('KIOSK_TRACK_IOU', 0.3))
+# Frames a track survives without a matching detection
+TRACK_MAX_MISSES = int(os.environ.get('KIOSK_TRACK_MAX_MISSES', 3))
+# Seconds after which an identified track is embedded and matched again
+TRACK_REFRESH_S = float(os.environ.get('KIOSK_TRACK_REFRESH_S', 10))
+# Seconds between attempts on a track that is unknown or failed the liveness check
+TRACK_RETRY_S = float(os.environ.get('KIOSK_TRACK_RETRY_S', 1))
+
+NO_FACE_RESULT = {"name": None, "message": "No face detected. Please try again.", "status": "No Face"}
+
+# Frames received and recognitions actually run, over all streaming connections
+stream_stats = {"connections": 0, "frames": 0, "recognitions": 0}
+_stream_stats_lock = threading.Lock()
+_track_ids = itertools.count(1)
+
+
+def _count(**increments):
+    with _stream_stats_lock:
+        for name, value in increments.items():
+            stream_stats[name] += value
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return float(intersection / union)
+
+
+class Track:
+    """One face followed across the frames of a connection"""
+
+    def __init__(self, bbox):
+        self.id = next(_track_ids)
+        self.bbox = bbox
+        self.misses = 0
+        self.name = None
+        self.result = None
+        self.recognized_at = None
+
+    def needs_recognition(self, now):
+        if self.recognized_at is None:
+            return True
+        stale_after = TRACK_REFRESH_S if self.name else TRACK_RETRY_S
+        return now - self.recognized_at >= stale_after
+
+
+class KioskSession:
+    """Per-connection tracker: faces are detected in every frame and matched to
+    tracks by box overlap; embedding and gallery matching only run for new
+    tracks and for tracks whose identity has gone stale.
+
+    Frames of one connection are processed one at a time, so no locking is needed.
+    """
+
+    def __init__(self, kiosk_id=None):
+        self.kiosk_id = kiosk_id
+        self.tracks = []
+        self.frame_change = FrameChangeDetector()
+        self.outcome_resets = attendance_outcome_resets()
+        _count(connections=1)
+
+    def _associate(self, faces):
+        """Pair every detected face with a track, greedily by IoU, and drop lost tracks"""
+        pairs = sorted(
+            ((box_iou(face.bbox, track.bbox), f, t) for f, face in enumerate(faces) for t, track in enumerate(self.tracks)),
+            key=lambda pair: pair[0], reverse=True,
+        )
+        face_tracks, used = {}, set()
+        for overlap, f, t in pairs:
+            if overlap < TRACK_IOU_THRESHOLD:
+                break
+            if f not in face_tracks and t not in used:
+                face_tracks[f] = self.tracks[t]
+                used.add(t)
+        for t, track in enumerate(self.tracks):
+            if t not in used:
+                track.misses += 1
+        tracks = [track for track in self.tracks if track.misses <= TRACK_MAX_MISSES]
+        for f, face in enumerate(faces):
+            track = face_tracks.get(f)
+            if track is None:
+                track = Track(face.bbox)
+                face_tracks[f] = track
+                tracks.append(track)
+            track.bbox = face.bbox
+            track.misses = 0
+        self.tracks = tracks
+        return [face_tracks[f] for f in range(len(faces))]
+
+    def _recognize(self, frame, face, track, now):
+        embed_faces(frame, [face])
+        is_live, employee_id, name, score = identify_face(frame, face, self.kiosk_id)
+        _count(recognitions=1)
+        track.recognized_at = now
+        if is_live is None:
+            # Not a verdict on this face: try again on the next frame instead of keeping it
+            track.name, track.result, track.recognized_at = None, dict(LIVENESS_UNAVAILABLE_RESULT), None
+        elif not is_live:
+            track.name, track.result = None, dict(SPOOF_RESULT)
+        elif name is None:
+            track.name, track.result = None, dict(UNKNOWN_RESULT)
+        else:
+            # Attendance is only marked when a track is (re)identified, not once per frame;
+            # process_attendance is debounced, so a refresh just picks up the current state
+            track.name, track.result = name, process_attendance(employee_id, name, score)
+
+    def process_frame(self, contents):
+        """Track faces in one encoded frame and return the result for the best face"""
+        _count(frames=1)
+        resets = attendance_outcome_resets()
+        if resets != self.outcome_resets:
+            # Someone punched out since: cached replies and track results may be stale
+            self.outcome_resets = resets
+            self.frame_change.reference = None
+            for track in self.tracks:
+                track.recognized_at = None
+        # A static scene keeps its tracks and reply without even running detection
+        thumb, cached = self.frame_change.check(contents)
+        if cached is not None:
+            return dict(cached, recognized=False)
+        reply = self._track(contents)
+        self.frame_change.update(thumb, reply)
+        return reply
+
+    def _track(self, contents):
+        frame = decode_frame(contents)
+        if frame is None:
+            return {"status": "error", "message": "Invalid image"}
+        faces = locate_faces(frame)
+        tracks = self._associate(faces)
+        if not faces:
+            return dict(NO_FACE_RESULT, track_id=None, recognized=False)
+
+        # Like /mark_attendance, only the most confident face is identified
+        face, track = faces[0], tracks[0]
+        now = time.monotonic()
+        recognized = track.needs_recognition(now)
+        if recognized:
+            self._recognize(frame, face, track, now)
+        return dict(track.result, track_id=track.id, recognized=recognized)
@@ -0,0 +1,130 @@
+# liveness.py
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import model_registry
+from face_pipeline import crop_to_box
+
+# Set to 0 to turn liveness checks off everywhere
+LIVENESS_ENABLED = os.environ.get('FACE_LIVENESS', '1') == '1'
+# Minimum "real face" probability for a frame to be accepted
+LIVENESS_THRESHOLD = float(os.environ.get('FACE_LIVENESS_THRESHOLD', 0.5))
+# Longest a recognition request waits for the liveness verdict
+LIVENESS_BUDGET_MS = float(os.environ.get('FACE_LIVENESS_BUDGET_MS', 150))
+# What happens to a frame whose check ran out of time or failed: 'reject' turns it away,
+# 'allow' accepts it unchecked (fails open, so a photo gets through whenever the server is loaded)
+LIVENESS_ON_TIMEOUT = os.environ.get('FACE_LIVENESS_ON_TIMEOUT', 'reject')
+# Seconds a kiosk should wait before resending a frame that was rejected unchecked
+LIVENESS_RETRY_AFTER = int(os.environ.get('FACE_LIVENESS_RETRY_AFTER', 1))
+# Kiosks (X-Kiosk-Id) that skip the check, e.g. attended entrances
+LIVENESS_SKIP_KIOSKS = {k.strip() for k in os.environ.get('FACE_LIVENESS_SKIP_KIOSKS', '').split(',') if k.strip()}
+# Context around the detected box given to MiniFASNet, as a fraction of the box size per side
+LIVENESS_CROP_MARGIN = float(os.environ.get('FACE_LIVENESS_CROP_MARGIN', 1.5))
+
+
+class LivenessChecker:
+    """Runs the anti-spoof model on detected face crops next to recognition.
+
+    `submit` starts the check on its own thread as soon as faces are found,
+    so it overlaps with gallery matching; `verdict` then waits at most what
+    is left of the latency budget. A check nobody waits for any more is
+    cancelled, or skipped if it already reached the model thread, so one slow
+    frame doesn't push every later check past its deadline.
+    """
+
+    def __init__(self, threshold=LIVENESS_THRESHOLD, budget_ms=LIVENESS_BUDGET_MS, skip_kiosks=LIVENESS_SKIP_KIOSKS):
+        self.threshold = threshold
+        self.budget = budget_ms / 1000.0
+        self.skip_kiosks = skip_kiosks
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="liveness")
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.timeouts = 0
+        self.expired = 0
+        self.errors = 0
+        self.failed_open = 0
+        self._predictions = 0
+        self._total_ms = 0.0
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def _predict(self, deadline, crops):
+        if time.monotonic() >= deadline:
+            # The request already gave up on this check
+            self._count(expired=1)
+            return None
+        start = time.perf_counter()
+        scores = model_registry.get_anti_spoof_predictor().predict_batch(crops)
+        self._count(_predictions=1, _total_ms=(time.perf_counter() - start) * 1000)
+        return scores
+
+    def applies(self, kiosk_id=None):
+        """True if frames from `kiosk_id` are liveness-checked"""
+        return (LIVENESS_ENABLED and kiosk_id not in self.skip_kiosks
+                and model_registry.get_anti_spoof_predictor() is not None)
+
+    def submit(self, image, faces, kiosk_id=None):
+        """Start checking `faces` of `image`; returns None when the check is skipped"""
+        if not self.applies(kiosk_id):
+            self._count(skipped=1)
+            return None
+        crops = [crop_to_box(image, face.bbox, margin=LIVENESS_CROP_MARGIN) for face in faces]
+        deadline = time.monotonic() + self.budget
+        return deadline, self._pool.submit(self._predict, deadline, crops)
+
+    def _unchecked(self, reason):
+        """Verdict for a frame whose check didn't produce a score"""
+        allow = LIVENESS_ON_TIMEOUT == 'allow'
+        self._count(failed_open=int(allow))
+        print(f"[LIVENESS] {reason}, {'allowing frame unchecked' if allow else 'rejecting frame'}")
+        return (True if allow else None), None
+
+    def verdict(self, check):
+        """(is_live, lowest score) for a submitted check, within the latency budget.
+        is_live is None when the frame is rejected because it could not be checked,
+        which says nothing about the face, so the kiosk should just retry."""
+        if check is None:
+            return True, None
+        deadline, future = check
+        try:
+            scores = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            self._count(timeouts=1)
+            return self._unchecked(f"Check exceeded its {self.budget * 1000:.0f} ms budget")
+        except Exception as e:
+            self._count(errors=1)
+            return self._unchecked(f"Check failed: {e}")
+        if scores is None:
+            self._count(timeouts=1)
+            return self._unchecked(f"Check exceeded its {self.budget * 1000:.0f} ms budget")
+        score = float(scores.min())
+        is_live = score >= self.threshold
+        self._count(checked=1, rejected=int(not is_live))
+        print(f"[LIVENESS] Score {score:.3f} (threshold {self.threshold}) -> {'live' if is_live else 'spoof'}")
+        return is_live, score
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "rejected": self.rejected,
+                "skipped": self.skipped,
+                "timeouts": self.timeouts,
+                "expired": self.expired,
+                "errors": self.errors,
+                "failed_open": self.failed_open,
+                "mean_ms": round(self._total_ms / self._predictions, 2) if self._predictions else 0,
+            }
+
+
+liveness_checker = LivenessChecker()
+if LIVENESS_ENABLED and LIVENESS_ON_TIMEOUT == 'allow':
+    print("[LIVENESS] WARNING: FACE_LIVENESS_ON_TIMEOUT=allow accepts frames whose check timed out or failed without a liveness check")
@@ -0,0 +1,183 @@
+# mail_outbox.py
+
+import os
+import time
+import smtplib
+import threading
+from email.mime.text import MIMEText
+from database import enqueue_email, claim_due_emails, mark_email_sent, mark_email_failed, release_emails, get_outbox_counts
+
+SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.example.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USER = os.environ.get('SMTP_USER', 'your@email.com')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', 'yourpassword')
+# Set to 0 for servers without STARTTLS / AUTH, e.g. a local aiosmtpd during development
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+SMTP_AUTH = os.environ.get('SMTP_AUTH', '1') == '1'
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 10))
+# The SMTP session is closed after this many idle seconds and reopened on demand
+SMTP_IDLE_S = float(os.environ.get('SMTP_IDLE_S', 60))
+
+# Emails sent per pass over the outbox
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 20))
+# How often the outbox is checked for emails queued by other processes or due for retry
+EMAIL_POLL_S = float(os.environ.get('EMAIL_POLL_S', 5))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 8))
+EMAIL_RETRY_BASE_S = float(os.environ.get('EMAIL_RETRY_BASE_S', 30))
+EMAIL_RETRY_MAX_S = float(os.environ.get('EMAIL_RETRY_MAX_S', 3600))
+# Seconds a sender holds the emails it claimed; after that another process may send them
+EMAIL_LEASE_S = float(os.environ.get('EMAIL_LEASE_S', 300))
+
+# SMTP errors that leave the session unusable. Every SMTPException is also an OSError,
+# so a rejected recipient, sender or message body must not be mistaken for one of these.
+_SESSION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError,
+                   smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError)
+
+
+def is_session_error(error):
+    """True if `error` means the connection is gone or was never usable (socket errors,
+    disconnects, failed HELO/STARTTLS/login), False for a rejection of one message"""
+    if isinstance(error, _SESSION_ERRORS):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def queue_email(to_email, subject, body):
+    """Write an email to the outbox and wake the sender; never blocks on the mail server"""
+    email_id = enqueue_email(to_email, subject, body)
+    if email_id is not None:
+        print(f"[EMAIL] Queued #{email_id} to {to_email}")
+        outbox_sender.wake()
+    return email_id
+
+
+class OutboxSender:
+    """Background thread draining the email outbox over one reused SMTP session.
+
+    Every API process runs one; each batch is claimed in the database first,
+    so no email is picked up by two senders. Failed emails are retried with
+    exponential backoff and given up on after EMAIL_MAX_ATTEMPTS; a dropped
+    connection is reopened once per batch.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._last_used = 0.0
+        self.sent = 0
+        self.failed_attempts = 0
+        self.connections = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=SMTP_TIMEOUT)
+            self._thread = None
+        self._close()
+
+    def wake(self):
+        self._wake.set()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_AUTH:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        self.connections += 1
+        return smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _session(self):
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def _send(self, email):
+        msg = MIMEText(email["body"])
+        msg['Subject'] = email["subject"]
+        msg['From'] = SMTP_USER
+        msg['To'] = email["to_email"]
+        try:
+            self._session().sendmail(SMTP_USER, [email["to_email"]], msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the idle session; reconnect once
+            self._smtp = None
+            self._session().sendmail(SMTP_USER, [email["to_email"]], msg.as_string())
+
+    def _retry_at(self, attempts):
+        if attempts + 1 >= EMAIL_MAX_ATTEMPTS:
+            return None
+        return time.time() + min(EMAIL_RETRY_MAX_S, EMAIL_RETRY_BASE_S * 2 ** attempts)
+
+    def drain_once(self):
+        """Send one batch of due emails; returns how many were sent"""
+        batch = claim_due_emails(time.time(), EMAIL_BATCH_SIZE, EMAIL_LEASE_S)
+        sent = 0
+        for position, email in enumerate(batch):
+            try:
+                self._send(email)
+            except Exception as e:
+                self.failed_attempts += 1
+                retry_at = self._retry_at(email["attempts"])
+                print(f"[EMAIL ERROR] #{email['id']} to {email['to_email']}: {e}"
+                      + ("" if retry_at else f", giving up after {email['attempts'] + 1} attempts"))
+                mark_email_failed(email["id"], str(e), retry_at)
+                if is_session_error(e):
+                    # The session is unusable (or never opened); hand the rest of the batch back for the next pass
+                    self._close()
+                    release_emails([rest["id"] for rest in batch[position + 1:]])
+                    break
+                continue
+            # Recorded right away, so a crash later in the batch doesn't send it again
+            mark_email_sent(email["id"])
+            sent += 1
+        if sent:
+            self.sent += sent
+            self._last_used = time.monotonic()
+            print(f"[EMAIL] Sent {sent} queued emails")
+        return sent
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                sent = self.drain_once()
+            except Exception as e:
+                print(f"[EMAIL ERROR] Outbox pass failed: {e}")
+                sent = 0
+            if sent >= EMAIL_BATCH_SIZE:
+                continue  # a full batch went out, more emails may be waiting
+            if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_S:
+                self._close()
+            self._wake.wait(EMAIL_POLL_S)
+
+    def stats(self):
+        counts = get_outbox_counts()
+        return {
+            "queue_depth": counts.get('pending', 0) + counts.get('sending', 0),
+            "sent": self.sent,
+            "failed_attempts": self.failed_attempts,
+            "given_up": counts.get('failed', 0),
+            "smtp_connections": self.connections,
+            "session_open": self._smtp is not None,
+        }
+
+
+outbox_sender = OutboxSender()
@@ -1,12 +1,23 @@
 # main.py
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Body
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Body, Header, Depends, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response, StreamingResponse
-import numpy as np
-import cv2
+from fastapi.responses import FileResponse, Response, StreamingResponse, JSONResponse
 from pydantic import BaseModel, Field
-from database import get_db_connection, delete_face_data, get_face_data, save_face_data, get_office_settings, update_office_settings, migrate_add_gender_column, migrate_add_mobile_no_column, migrate_add_address_column, migrate_add_joining_date_column
-from recognize_module import recognize_and_log_image
+from database import get_db_connection, db_session, pool_stats, delete_face_data, get_face_data, save_face_data, update_office_settings, encode_embedding, migrate_add_gender_column, migrate_add_mobile_no_column, migrate_add_address_column, migrate_add_joining_date_column, migrate_face_embeddings_to_raw
+from recognize_module import variant_stats, debounce_stats, forget_attendance_outcome
+from image_ingest import decode_upload, ingest_stats
+from mail_outbox import outbox_sender
+from inference_scheduler import embedding_batcher
+from liveness import liveness_checker
+from kiosk_stream import KioskSession, stream_stats
+from frame_gate import frame_gate, gate_stats, invalidate as invalidate_frame_gate
+from recent_matches import recent_matches
+from reference_data import reference_data
+from inference_executor import inference_executor, InferenceQueueFull, INFERENCE_RETRY_AFTER
+from face_gallery import gallery
+import model_registry
+import recognition_workers
+from face_pipeline import get_faces, crop_to_box
 from register_module import router as register_router  # Import router
 from typing import Optional, List
 import os
@@ -18,6 +29,7 @@ from datetime import datetime, date, time, timedelta
 import sqlite3
 import io
 import csv
+import json
 
 
 class AdminLogin(BaseModel):
@@ -107,22 +119,139 @@ migrate_add_mobile_no_column()
 migrate_add_address_column()
 migrate_add_joining_date_column()
 
+# Convert legacy pickled face embeddings to the raw float format
+migrate_face_embeddings_to_raw()
+
 # Database is initialized separately - not on every server startup
 from database import init_database
 init_database()
 
+# Seconds a kiosk should wait before retrying while models are still warming up
+WARM_UP_RETRY_AFTER = 5
+
+@app.on_event("startup")
+def start_model_warm_up():
+    # Models and the face gallery load in the background so DB-backed endpoints are served immediately
+    model_registry.start_background_warm_up(before_ready=[gallery.preload])
+    # Results replayed for unchanged kiosk frames are stale once someone is enrolled or removed
+    gallery.add_listener(invalidate_frame_gate)
+    # Optional pool of recognition processes sharing the memory-mapped gallery
+    recognition_workers.start()
+    # Punch notifications are delivered from the outbox, off the request path
+    outbox_sender.start()
+
+@app.on_event("shutdown")
+def stop_recognition_workers():
+    recognition_workers.shutdown()
+    outbox_sender.stop()
+
+@app.get("/health/live")
+def health_live():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready():
+    """Face recognition models are loaded and warm"""
+    if model_registry.is_ready() and recognition_workers.is_ready():
+        return {"status": "ready"}
+    detail = {"status": "warming_up"}
+    error = model_registry.warm_up_error or recognition_workers.warm_up_error()
+    if error:
+        detail = {"status": "error", "message": error}
+    return JSONResponse(status_code=503, content=detail, headers={"Retry-After": str(WARM_UP_RETRY_AFTER)})
+
+@app.get("/metrics/recognition")
+def recognition_metrics():
+    """Counters of the recognition pipeline: upload decoding, skipped frames, shortlist hits, variant hit rates, batch sizes, liveness checks, streaming, debounced punches, the email outbox, the reference-data cache and database connection reuse"""
+    return {
+        "inference": inference_executor.stats(),
+        "ingest": ingest_stats.stats(),
+        "frame_gate": dict(gate_stats),
+        "recent_matches": recent_matches.stats(),
+        "variants": dict(variant_stats),
+        "batching": embedding_batcher.stats(),
+        "liveness": liveness_checker.stats(),
+        "kiosk_stream": dict(stream_stats),
+        "attendance_debounce": dict(debounce_stats),
+        "email_outbox": outbox_sender.stats(),
+        "reference_data": reference_data.stats(),
+        "database": pool_stats(),
+    }
+
+async def run_kiosk_recognition(fn, *args):
+    """Run a recognition job on the inference executor, answering 503 while warming up or saturated"""
+    if not (model_registry.is_ready() and recognition_workers.is_ready()):
+        raise HTTPException(
+            status_code=503,
+            detail="Face recognition is starting up, please try again shortly.",
+            headers={"Retry-After": str(WARM_UP_RETRY_AFTER)},
+        )
+    # Decoding and recognition run on the dedicated inference executor so the event loop
+    # and the admin endpoints stay responsive while kiosks are saturating the CPU
+    try:
+        return await inference_executor.run(fn, *args)
+    except InferenceQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Face recognition is busy, please try again shortly.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)},
+        )
+
 # Attendance marking endpoint
 @app.post("/mark_attendance")
-async def mark_attendance(file: UploadFile = File(...)):
+async def mark_attendance(request: Request, file: UploadFile = File(...), kiosk_id: Optional[str] = Header(None, alias="X-Kiosk-Id")):
     contents = await file.read()
-    np_img = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-    
-    if frame is None:
-        return {"status": "error", "message": "Invalid image"}
+    # Kiosks without an id are told apart by address for the unchanged-frame check
+    gate_key = kiosk_id or (request.client.host if request.client else None)
+    return await run_kiosk_recognition(recognition_workers.recognize, contents, kiosk_id, gate_key)
+
+# Kiosks that detect and align faces themselves upload only the face crop
+@app.post("/mark_attendance/aligned")
+async def mark_attendance_aligned(
+    file: UploadFile = File(...),
+    landmarks: Optional[str] = Form(None),
+    kiosk_id: Optional[str] = Header(None, alias="X-Kiosk-Id"),
+):
+    points = None
+    if landmarks:
+        try:
+            points = [float(v) for v in json.loads(landmarks)]
+        except (ValueError, TypeError):
+            points = None
+        if points is None or len(points) != 10:
+            raise HTTPException(status_code=400, detail="landmarks must be a JSON list of 10 numbers (5 x, y points)")
+    contents = await file.read()
+    return await run_kiosk_recognition(recognition_workers.recognize_aligned, contents, points, kiosk_id)
 
-    result = recognize_and_log_image(frame)
-    return result
+# Streaming recognition: the kiosk sends encoded frames as binary messages and gets one JSON reply per frame
+@app.websocket("/ws/kiosk")
+async def kiosk_stream(websocket: WebSocket, kiosk_id: Optional[str] = None):
+    await websocket.accept()
+    session = KioskSession(kiosk_id)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            contents = message.get("bytes")
+            if not contents:
+                await websocket.send_json({"status": "error", "message": "Expected an encoded image as a binary message"})
+                continue
+            if not model_registry.is_ready():
+                await websocket.send_json({"status": "Starting", "retry_after": WARM_UP_RETRY_AFTER})
+                continue
+            try:
+                result = await inference_executor.run(session.process_frame, contents)
+            except InferenceQueueFull:
+                result = {"status": "Busy", "retry_after": INFERENCE_RETRY_AFTER}
+            except Exception as e:
+                # One bad frame must not end the kiosk's stream
+                print(f"[STREAM ERROR] Kiosk {kiosk_id}: {e}")
+                result = {"status": "error", "message": "Could not process frame"}
+            await websocket.send_json(result)
+    except WebSocketDisconnect:
+        pass
 
 @app.post("/employees/")
 def create_employee(emp: Employee):
@@ -141,6 +270,7 @@ def create_employee(emp: Employee):
         """, (emp.id, emp.name, emp.email, emp.mobile_no, emp.address, emp.gender, emp.department, emp.position, emp.salary, emp.working_hours_per_day, emp.employee_type, emp.joining_date))
         emp_id = emp.id # ID is provided in input
         conn.commit()
+        reference_data.invalidate("employees")
         print(f"[DEBUG] Employee inserted with id: {emp_id}")
         return {"status": "success", "employee_id": emp_id}
     except Exception as e:
@@ -154,14 +284,12 @@ def create_employee(emp: Employee):
         conn.close()
 
 @app.get("/employees/")
-def get_employees():
-    conn = get_db_connection()
+def get_employees(conn: sqlite3.Connection = Depends(db_session)):
     cur = conn.cursor()
     cur.execute("SELECT id, name, email, mobile_no, address, gender, department, position, salary, working_hours_per_day, (photo_data IS NOT NULL) as has_photo, employee_type, joining_date FROM employees;")
     rows = cur.fetchall()
     rows = rows or []
     cur.close()
-    conn.close()
     employees = [
         {
             "id": row[0],
@@ -192,6 +320,8 @@ def update_employee(emp_id: str, emp: Employee):
             WHERE id=?
         """, (emp.name, emp.email, emp.mobile_no, emp.address, emp.gender, emp.department, emp.position, emp.salary, emp.working_hours_per_day, emp.employee_type, emp.joining_date, emp_id))
         conn.commit()
+        reference_data.invalidate("employees")
+        gallery.rename(emp_id, emp.name)
         return {"status": "success", "employee_id": emp_id}
     except Exception as e:
         conn.rollback()
@@ -212,6 +342,8 @@ def delete_employee(emp_id: str):
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Employee not found")
 
+        reference_data.invalidate("employees")
+        gallery.remove(emp_id)
         return {"status": "success", "employee_id": emp_id}
     except Exception as e:
         conn.rollback()
@@ -251,8 +383,9 @@ async def update_employee_photo(emp_id: str, file: UploadFile = File(...)):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT id FROM employees WHERE id = ?", (emp_id,))
-        if not cur.fetchone():
+        cur.execute("SELECT id, name FROM employees WHERE id = ?", (emp_id,))
+        employee = cur.fetchone()
+        if not employee:
             raise HTTPException(status_code=404, detail="Employee not found")
     finally:
         cur.close()
@@ -260,35 +393,24 @@ async def update_employee_photo(emp_id: str, file: UploadFile = File(...)):
     
     # Process image and extract embedding
     try:
-        np_img = np.frombuffer(contents, np.uint8)
-        frame = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
+        frame, _ = decode_upload(contents)
         
         if frame is None:
             raise HTTPException(status_code=400, detail="Invalid image")
         
-        # Import here to avoid circular imports
-        from insightface.app import FaceAnalysis
-        import mediapipe as mp
-        from sklearn.metrics.pairwise import cosine_similarity
-        import pickle
-        
         # Face detection
-        mp_face_detection = mp.solutions.face_detection
-        with mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.6) as face_detection:
-            results = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            if not results.detections:
-                raise HTTPException(status_code=400, detail="No face detected")
+        boxes = model_registry.detect_faces_mediapipe(frame)
+        if not boxes:
+            raise HTTPException(status_code=400, detail="No face detected")
         
-        # Get embedding
-        embedder = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])
-        embedder.prepare(ctx_id=0, det_size=(640, 640))
-        faces = embedder.get(frame)
+        # Get embedding from the shared model, detecting only inside the MediaPipe box
+        faces = get_faces(crop_to_box(frame, boxes[0]), limit=1)
         
         if not faces:
             raise HTTPException(status_code=400, detail="Could not extract embedding")
         
         embedding = faces[0].normed_embedding
-        embedding_bytes = pickle.dumps(embedding)
+        embedding_bytes = encode_embedding(embedding)
         
         # Save to database
         success = save_face_data(emp_id, embedding_bytes, contents)
@@ -296,6 +418,7 @@ async def update_employee_photo(emp_id: str, file: UploadFile = File(...)):
         if not success:
             raise HTTPException(status_code=500, detail="Failed to save face data")
         
+        gallery.upsert(emp_id, employee['name'], embedding)
         return {"status": "success", "message": "Photo updated successfully"}
         
     except Exception as e:
@@ -398,6 +521,7 @@ def create_holiday(holiday: Holiday):
         )
         new_id = cur.lastrowid
         conn.commit()
+        reference_data.invalidate("holidays")
         return HolidayInDB(id=new_id, **holiday.dict())
     except sqlite3.IntegrityError:
         conn.rollback()
@@ -410,8 +534,7 @@ def create_holiday(holiday: Holiday):
         conn.close()
 
 @app.get("/holidays/")
-def get_holidays_for_year(year: int):
-    conn = get_db_connection()
+def get_holidays_for_year(year: int, conn: sqlite3.Connection = Depends(db_session)):
     cur = conn.cursor()
     try:
         cur.execute("""
@@ -423,7 +546,6 @@ def get_holidays_for_year(year: int):
         rows = cur.fetchall()
         rows = rows or []
         cur.close()
-        conn.close()
         holidays = [
             {
                 "id": row[0],
@@ -449,6 +571,7 @@ def delete_holiday(holiday_id: int):
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Holiday not found")
         conn.commit()
+        reference_data.invalidate("holidays")
     finally:
         cur.close()
         conn.close()
@@ -491,8 +614,7 @@ def create_leave(leave: Leave):
         conn.close()
 
 @app.get("/leaves/", response_model=List[LeaveInDB])
-def get_leaves_for_month(year: int, month: int):
-    conn = get_db_connection()
+def get_leaves_for_month(year: int, month: int, conn: sqlite3.Connection = Depends(db_session)):
     cur = conn.cursor()
     try:
         cur.execute("""
@@ -509,12 +631,10 @@ def get_leaves_for_month(year: int, month: int):
         ) for r in rows]
     finally:
         cur.close()
-        conn.close()
 
 @app.get("/leaves/all/", response_model=List[LeaveInDB])
-def get_all_leaves_for_year(year: int):
+def get_all_leaves_for_year(year: int, conn: sqlite3.Connection = Depends(db_session)):
     """Get all leaves for a specific year (all months)"""
-    conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute("""
@@ -531,12 +651,10 @@ def get_all_leaves_for_year(year: int):
         ) for r in rows]
     finally:
         cur.close()
-        conn.close()
 
 @app.get("/leaves/employee/{employee_id}/", response_model=List[LeaveInDB])
-def get_leaves_for_employee(employee_id: str, year: Optional[int] = None):
+def get_leaves_for_employee(employee_id: str, year: Optional[int] = None, conn: sqlite3.Connection = Depends(db_session)):
     """Get all leaves for a specific employee, optionally filtered by year"""
-    conn = get_db_connection()
     cur = conn.cursor()
     try:
         if year:
@@ -562,7 +680,6 @@ def get_leaves_for_employee(employee_id: str, year: Optional[int] = None):
         ) for r in rows]
     finally:
         cur.close()
-        conn.close()
 
 @app.delete("/leaves/{leave_id}", status_code=204)
 def delete_leave(leave_id: int):
@@ -641,27 +758,17 @@ def get_attendance_by_month(year: int, month: int):
         conn.close()
 
 @app.get("/attendance/{year}/{month}")
-def get_monthly_attendance(year: int, month: int):
+def get_monthly_attendance(year: int, month: int, conn: sqlite3.Connection = Depends(db_session)):
     """
     New function to get monthly attendance data, including holidays and weekend days.
     """
-    conn = get_db_connection()
     cur = conn.cursor()
 
     try:
-        # Get all employees
-        cur.execute("SELECT id, name, joining_date FROM employees")
-        employees = cur.fetchall()
-        employee_data = {name: emp_id for emp_id, name, _ in employees}
-        joining_dates = {}
-        for emp_id, _, joining_date_str in employees:
-            if joining_date_str:
-                try:
-                    joining_dates[emp_id] = datetime.strptime(joining_date_str, '%Y-%m-%d').date()
-                except ValueError:
-                    joining_dates[emp_id] = None
-            else:
-                joining_dates[emp_id] = None
+        # Get all employees, with joining dates already parsed
+        employees = reference_data.employees()
+        employee_data = {emp.name: emp.id for emp in employees}
+        joining_dates = {emp.id: emp.joining_date for emp in employees}
 
         # Get attendance for the month
         cur.execute("""
@@ -672,36 +779,10 @@ def get_monthly_attendance(year: int, month: int):
         
         attendance_records = cur.fetchall()
 
-        # Get holidays for the month
-        cur.execute("""
-            SELECT date, name
-            FROM holidays
-            WHERE strftime('%Y', date) = ? AND strftime('%m', date) = ? AND type != 'WORKING_DAY'
-        """, (str(year), f"{month:02d}"))
-        holidays_records = cur.fetchall()
-        holidays_records = cur.fetchall()
-        holidays = {}
-        for rec in holidays_records:
-            try:
-                d = datetime.strptime(rec[0], '%Y-%m-%d').day
-                holidays[d] = rec[1]
-            except ValueError:
-                continue
-        
-        # Get converted working days for the month
-        cur.execute("""
-            SELECT date
-            FROM holidays
-            WHERE strftime('%Y', date) = ? AND strftime('%m', date) = ? AND type = 'WORKING_DAY'
-        """, (str(year), f"{month:02d}"))
-        working_days_records = cur.fetchall()
-        working_days_records = cur.fetchall()
-        working_days = []
-        for rec in working_days_records:
-            try:
-                working_days.append(datetime.strptime(rec[0], '%Y-%m-%d').day)
-            except ValueError:
-                continue
+        # Get holidays and converted working days for the month
+        holiday_year = reference_data.holidays(year)
+        holidays = {d.day: name for d, name in holiday_year.holidays.items() if d.month == month}
+        working_days = sorted(d.day for d in holiday_year.working_days if d.month == month)
 
         # Get approved leaves for the month
         cur.execute("""
@@ -799,10 +880,9 @@ def get_monthly_attendance(year: int, month: int):
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
     finally:
         cur.close()
-        conn.close()
 
 @app.post("/punch_out")
-def punch_out(req: PunchOutRequest):
+def punch_out(req: PunchOutRequest, request: Request, kiosk_id: Optional[str] = Header(None, alias="X-Kiosk-Id")):
     """Handle punch-out requests"""
     today = datetime.now().strftime("%Y-%m-%d")
     
@@ -812,23 +892,24 @@ def punch_out(req: PunchOutRequest):
     success = punch_out_employee(req.name, today)
     
     if success:
+        # The next scan must show the punched-out state, not the debounced punch-out prompt
+        # or the result the frame gate cached for this kiosk's unchanged scene
+        forget_attendance_outcome(req.name)
+        frame_gate.forget(kiosk_id or (request.client.host if request.client else None))
         return {"status": "success", "message": f"{req.name} punched out successfully."}
     else:
         # This could be because they already punched out or were never punched in.
         raise HTTPException(status_code=400, detail="Failed to punch out. Employee may not have punched in or has already punched out.")
 
 @app.get("/api/landing-stats")
-def get_landing_stats():
+def get_landing_stats(conn: sqlite3.Connection = Depends(db_session)):
     """Get statistics for the landing page without affecting existing logic"""
-    conn = get_db_connection()
     cur = conn.cursor()
     today_str = date.today().isoformat()
 
     try:
         # Total employees
-        cur.execute("SELECT COUNT(*) as total FROM employees")
-        result = cur.fetchone()
-        total_employees = result[0] if result else 0
+        total_employees = len(reference_data.employees())
 
         # Present today (On Time)
         cur.execute("""
@@ -890,7 +971,6 @@ def get_landing_stats():
         }
     finally:
         cur.close()
-        conn.close()
 
 @app.get("/test_face_similarities")
 def test_face_similarities():
@@ -938,6 +1018,7 @@ def create_working_day(working_day: WorkingDay):
         
         new_id = cur.lastrowid
         conn.commit()
+        reference_data.invalidate("holidays")
         
         return {
             "id": new_id,
@@ -958,9 +1039,8 @@ def create_working_day(working_day: WorkingDay):
         conn.close()
 
 @app.get("/working-days/")
-def get_working_days_for_year(year: int):
+def get_working_days_for_year(year: int, conn: sqlite3.Connection = Depends(db_session)):
     """Get all working days (converted weekends) for a specific year"""
-    conn = get_db_connection()
     cur = conn.cursor()
     
     try:
@@ -990,7 +1070,6 @@ def get_working_days_for_year(year: int):
         raise HTTPException(status_code=500, detail=f"Failed to fetch working days: {str(e)}")
     finally:
         cur.close()
-        conn.close()
 
 @app.delete("/working-days/{working_day_id}", status_code=204)
 def delete_working_day(working_day_id: int):
@@ -1011,6 +1090,7 @@ def delete_working_day(working_day_id: int):
         
         cur.execute("DELETE FROM holidays WHERE id = ?", (working_day_id,))
         conn.commit()
+        reference_data.invalidate("holidays")
         
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Working day not found")
@@ -1026,7 +1106,7 @@ def delete_working_day(working_day_id: int):
 
 @app.get('/office-settings')
 def get_office_settings_api():
-    settings = get_office_settings()
+    settings = reference_data.office_settings().raw
     if not settings:
         raise HTTPException(status_code=404, detail='Office settings not found')
     return settings
@@ -1039,6 +1119,7 @@ def update_office_settings_api(payload: dict):
     if not (start_time and end_time and on_time_limit):
         raise HTTPException(status_code=400, detail='All fields are required')
     success = update_office_settings(start_time, end_time, on_time_limit)
+    reference_data.invalidate("office_settings")
     if not success:
         raise HTTPException(status_code=500, detail='Failed to update office settings')
     return {'message': 'Office settings updated successfully'}
@@ -1076,24 +1157,14 @@ def export_attendance_csv(
         gender = filters.get('gender')
 
         # Get employees with optional department/type/gender filter
-        emp_query = "SELECT id, name, department, employee_type, gender, joining_date FROM employees"
-        emp_params = []
-        where_clauses = []
-        if department:
-            where_clauses.append("department = ?")
-            emp_params.append(department)
-        if employee_type:
-            where_clauses.append("employee_type = ?")
-            emp_params.append(employee_type)
-        if gender:
-            where_clauses.append("gender = ?")
-            emp_params.append(gender)
-        if where_clauses:
-            emp_query += " WHERE " + " AND ".join(where_clauses)
-        emp_query += " ORDER BY name"
-        cur.execute(emp_query, tuple(emp_params))
-        employees = cur.fetchall()
-        employee_map = {row[1]: row for row in employees}  # name: (id, name, department, type, joining_date)
+        employees = [
+            (emp.id, emp.name, emp.department, emp.employee_type, emp.gender, emp.joining_date)
+            for emp in sorted(reference_data.employees(), key=lambda emp: emp.name)
+            if (not department or emp.department == department)
+            and (not employee_type or emp.employee_type == employee_type)
+            and (not gender or emp.gender == gender)
+        ]
+        employee_map = {row[1]: row for row in employees}  # name: (id, name, department, type, gender, joining_date)
         employee_ids = [row[0] for row in employees]
 
         # Determine date range
@@ -1136,16 +1207,7 @@ def export_attendance_csv(
         leave_map = {(row[0], row[1]): 'L' for row in leave_records}
 
         # Get holidays in range
-        cur.execute(
-            """
-            SELECT date, name
-            FROM holidays
-            WHERE date >= ? AND date <= ? AND type != 'WORKING_DAY'
-            """,
-            (start_date, end_date)
-        )
-        holiday_records = cur.fetchall()
-        holiday_map = {row[0]: row[1] for row in holiday_records}
+        holiday_map = reference_data.holidays_between(start_date, end_date)
 
         # Build list of all days in range
         all_dates = []
@@ -1154,18 +1216,8 @@ def export_attendance_csv(
             all_dates.append(d)
             d += timedelta(days=1)
 
-        # Parse joining dates to date objects
-        joining_dates = {}
-        for row in employees:
-            emp_id = row[0]
-            joining_date_str = row[5]  # joining_date is at index 5
-            if joining_date_str:
-                try:
-                    joining_dates[emp_id] = datetime.strptime(joining_date_str, '%Y-%m-%d').date()
-                except ValueError:
-                    joining_dates[emp_id] = None
-            else:
-                joining_dates[emp_id] = None
+        # Joining dates, already parsed to date objects
+        joining_dates = {row[0]: row[5] for row in employees}
 
         # Filter employees by status if needed (status filter is for attendance status, e.g. Present, Absent, etc.)
         filtered_employees = employees
@@ -1186,7 +1238,7 @@ def export_attendance_csv(
             header = ['Employee Name'] + [d.strftime('%Y-%m-%d') for d in all_dates]
             writer.writerow(header)
             for row in filtered_employees:
-                emp_id, name, dept, etype, gender, joining_date_str = row
+                emp_id, name, dept, etype, gender, _ = row
                 joining_date = joining_dates.get(emp_id)
                 rowdata = [name]
                 for d in all_dates:
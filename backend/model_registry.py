@@ -0,0 +1,230 @@
+# model_registry.py
+
+import os
+import sys
+import time
+import queue
+import threading
+import cv2
+import numpy as np
+
+# insightface and mediapipe are imported inside the loaders below so that
+# importing this module (and main) stays cheap; models are built on first
+# use or by the background warm-up.
+
+# Single InsightFace model pack shared by recognition, registration and photo updates
+MODEL_NAME = "buffalo_l"
+PROVIDERS = ["CPUExecutionProvider"]
+DET_SIZE = (640, 640)
+
+# 'fast' loads only detection + recognition and detects at the smallest size first,
+# 'full' runs every buffalo_l module (landmarks, gender/age) at DET_SIZE
+PIPELINE_MODE = os.environ.get('FACE_PIPELINE_MODE', 'fast')
+# Detection resolutions tried in order by the fast pipeline until a face is found
+DETECTION_SIZES = [(int(size), int(size)) for size in os.environ.get('FACE_DET_SIZES', '320,640').split(',')]
+
+# MediaPipe gate used before enrolling a face
+MEDIAPIPE_MODEL_SELECTION = 1
+MEDIAPIPE_MIN_CONFIDENCE = 0.6
+# Long-lived detectors shared by the registration endpoints
+MEDIAPIPE_POOL_SIZE = int(os.environ.get('MEDIAPIPE_POOL_SIZE', 2))
+
+# MiniFASNet liveness weights; liveness checks are disabled when the file is missing
+ANTI_SPOOF_MODEL_PATH = os.environ.get(
+    'ANTI_SPOOF_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils', 'models', 'anti_spoof.pth'))
+# Exported by export_anti_spoof.py; runs on onnxruntime without importing torch
+ANTI_SPOOF_ONNX_PATH = os.environ.get('ANTI_SPOOF_ONNX_PATH', os.path.splitext(ANTI_SPOOF_MODEL_PATH)[0] + '.onnx')
+# 'auto' uses the ONNX model when it exists or torch isn't installed, 'torch' or 'onnx' force a backend
+ANTI_SPOOF_BACKEND = os.environ.get('ANTI_SPOOF_BACKEND', 'auto')
+ANTI_SPOOF_MAX_BATCH_SIZE = int(os.environ.get('ANTI_SPOOF_MAX_BATCH_SIZE', 8))
+# Keep the small liveness model from competing with ONNX Runtime for every core
+ANTI_SPOOF_THREADS = int(os.environ.get('ANTI_SPOOF_THREADS', 1))
+
+_lock = threading.Lock()
+_face_analysis = None
+_mediapipe_pool = None
+_anti_spoof_predictor = None
+_anti_spoof_loaded = False
+anti_spoof_backend = None
+_ready = threading.Event()
+_warm_up_thread = None
+warm_up_error = None
+
+
+def get_face_analysis():
+    """Return the process-wide prepared FaceAnalysis, building it on first use"""
+    global _face_analysis
+    if _face_analysis is None:
+        with _lock:
+            if _face_analysis is None:
+                from insightface.app import FaceAnalysis
+                allowed_modules = ['detection', 'recognition'] if PIPELINE_MODE == 'fast' else None
+                face_analysis = FaceAnalysis(name=MODEL_NAME, providers=PROVIDERS, allowed_modules=allowed_modules)
+                face_analysis.prepare(ctx_id=0, det_size=DET_SIZE)
+                _face_analysis = face_analysis
+    return _face_analysis
+
+
+def _get_mediapipe_pool():
+    """Queue of MediaPipe detectors; a graph is not safe to run from several threads,
+    so each call borrows one detector exclusively"""
+    global _mediapipe_pool
+    if _mediapipe_pool is None:
+        with _lock:
+            if _mediapipe_pool is None:
+                import mediapipe as mp
+                pool = queue.Queue()
+                for _ in range(MEDIAPIPE_POOL_SIZE):
+                    pool.put(mp.solutions.face_detection.FaceDetection(
+                        model_selection=MEDIAPIPE_MODEL_SELECTION,
+                        min_detection_confidence=MEDIAPIPE_MIN_CONFIDENCE,
+                    ))
+                _mediapipe_pool = pool
+    return _mediapipe_pool
+
+
+def detect_faces_mediapipe(frame):
+    """Run a pooled MediaPipe face detector on a BGR frame.
+    Returns (x1, y1, x2, y2, score) pixel boxes sorted by score, possibly empty."""
+    pool = _get_mediapipe_pool()
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    detector = pool.get()
+    try:
+        results = detector.process(rgb)
+    finally:
+        pool.put(detector)
+    height, width = frame.shape[:2]
+    boxes = []
+    for detection in results.detections or []:
+        box = detection.location_data.relative_bounding_box
+        x1, y1 = max(0, int(box.xmin * width)), max(0, int(box.ymin * height))
+        x2, y2 = min(width, int((box.xmin + box.width) * width)), min(height, int((box.ymin + box.height) * height))
+        if x2 > x1 and y2 > y1:
+            boxes.append((x1, y1, x2, y2, float(detection.score[0])))
+    return sorted(boxes, key=lambda b: b[4], reverse=True)
+
+
+def _choose_anti_spoof_backend():
+    if ANTI_SPOOF_BACKEND != 'auto':
+        return ANTI_SPOOF_BACKEND
+    import importlib.util
+    if os.path.exists(ANTI_SPOOF_ONNX_PATH) or importlib.util.find_spec('torch') is None:
+        return 'onnx'
+    return 'torch'
+
+
+def _load_anti_spoof_predictor(backend):
+    if backend == 'onnx':
+        from utils.onnx_anti_spoof_predictor import OnnxAntiSpoofPredictor
+        return OnnxAntiSpoofPredictor(ANTI_SPOOF_ONNX_PATH, max_batch_size=ANTI_SPOOF_MAX_BATCH_SIZE,
+                                      providers=PROVIDERS, threads=ANTI_SPOOF_THREADS)
+    import torch
+    from utils.anti_spoof_predictor import AntiSpoofPredictor
+    torch.set_num_threads(ANTI_SPOOF_THREADS)
+    return AntiSpoofPredictor(ANTI_SPOOF_MODEL_PATH, max_batch_size=ANTI_SPOOF_MAX_BATCH_SIZE)
+
+
+def _anti_spoof_model_path():
+    return ANTI_SPOOF_ONNX_PATH if anti_spoof_backend == 'onnx' else ANTI_SPOOF_MODEL_PATH
+
+
+def get_anti_spoof_predictor():
+    """Return the shared anti-spoof predictor (torch or onnxruntime), or None when no usable model is available"""
+    global _anti_spoof_predictor, _anti_spoof_loaded, anti_spoof_backend
+    if not _anti_spoof_loaded:
+        with _lock:
+            if not _anti_spoof_loaded:
+                anti_spoof_backend = _choose_anti_spoof_backend()
+                model_path = _anti_spoof_model_path()
+                if os.path.exists(model_path):
+                    try:
+                        _anti_spoof_predictor = _load_anti_spoof_predictor(anti_spoof_backend)
+                    except Exception as e:
+                        print(f"[MODELS ERROR] Could not load {anti_spoof_backend} anti-spoof model: {e}")
+                else:
+                    print(f"[MODELS] No anti-spoof model at {model_path}, liveness checks disabled")
+                _anti_spoof_loaded = True
+    return _anti_spoof_predictor
+
+
+def _current_rss_mb():
+    """Resident set size of this process in MB, or None where it can't be read cheaply"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+
+def load_all(with_mediapipe=True):
+    """Build every shared model now and print their memory footprint.
+    MediaPipe is only used by registration, so recognition processes leave it out."""
+    rss_before = _current_rss_mb()
+    face_analysis = get_face_analysis()
+    if with_mediapipe:
+        _get_mediapipe_pool()
+    anti_spoof = get_anti_spoof_predictor()
+    rss_after = _current_rss_mb()
+
+    print(f"[MODELS] {MODEL_NAME} loaded in '{PIPELINE_MODE}' mode with providers {PROVIDERS}, det_size={DET_SIZE}")
+    total_file_mb = 0.0
+    for task, model in face_analysis.models.items():
+        file_mb = os.path.getsize(model.model_file) / (1024 * 1024)
+        total_file_mb += file_mb
+        print(f"[MODELS]   {task:<12} {os.path.basename(model.model_file):<24} {file_mb:7.1f} MB")
+    mediapipe = f"{MEDIAPIPE_POOL_SIZE} MediaPipe detectors model_selection={MEDIAPIPE_MODEL_SELECTION}" if with_mediapipe else "no MediaPipe"
+    print(f"[MODELS]   ONNX weights total {total_file_mb:.1f} MB, {mediapipe}")
+    if anti_spoof is not None:
+        model_path = _anti_spoof_model_path()
+        print(f"[MODELS]   anti-spoof   {os.path.basename(model_path):<24} {os.path.getsize(model_path) / (1024 * 1024):7.1f} MB ({anti_spoof_backend})")
+    if rss_before is not None and rss_after is not None:
+        print(f"[MODELS] Process RSS {rss_after:.0f} MB ({rss_after - rss_before:+.0f} MB for models)")
+
+
+def is_ready():
+    """True once every model is loaded and has run a warm-up inference"""
+    return _ready.is_set()
+
+
+def warm_up(before_ready=(), with_mediapipe=True):
+    """Load all models, run one dummy inference through each, then mark the registry ready.
+    `before_ready` callables (e.g. loading the face gallery) run before readiness is signalled."""
+    global warm_up_error
+    try:
+        start = time.perf_counter()
+        load_all(with_mediapipe)
+        face_analysis = get_face_analysis()
+        dummy = np.zeros((DET_SIZE[1], DET_SIZE[0], 3), dtype=np.uint8)
+        face_analysis.get(dummy)
+        for size in DETECTION_SIZES:
+            face_analysis.det_model.detect(dummy, input_size=size)
+        # A blank frame has no face, so run the recognition model directly on an aligned-size crop
+        face_analysis.models['recognition'].get_feat(np.zeros((112, 112, 3), dtype=np.uint8))
+        if with_mediapipe:
+            detect_faces_mediapipe(dummy)
+        anti_spoof = get_anti_spoof_predictor()
+        if anti_spoof is not None:
+            anti_spoof.predict_batch([np.zeros((112, 112, 3), dtype=np.uint8)])
+        for step in before_ready:
+            step()
+        _ready.set()
+        print(f"[MODELS] Warm-up finished in {time.perf_counter() - start:.1f} s, ready for inference")
+    except Exception as e:
+        warm_up_error = str(e)
+        print(f"[MODELS ERROR] Warm-up failed: {e}")
+
+
+def start_background_warm_up(before_ready=()):
+    """Run warm_up on a daemon thread so the server can start serving immediately"""
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, args=(before_ready,), name="model-warm-up", daemon=True)
+            _warm_up_thread.start()
@@ -0,0 +1,87 @@
+# recent_matches.py
+
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from face_gallery import gallery, normalize_embedding
+
+# Recently recognized identities remembered per kiosk (0 disables the shortlist)
+RECENT_MATCHES_SIZE = int(os.environ.get('FACE_RECENT_MATCHES', 32))
+# A shortlist hit is only accepted when it clears the recognition threshold by this much
+RECENT_MATCH_MARGIN = float(os.environ.get('FACE_RECENT_MATCH_MARGIN', 0.1))
+RECENT_MATCH_MAX_KIOSKS = int(os.environ.get('FACE_RECENT_MATCH_MAX_KIOSKS', 256))
+
+
+class RecentMatches:
+    """Per-kiosk LRU shortlist of recently matched identities and their gallery
+    embeddings, checked before the full gallery search.
+
+    The same people pass the same entrance again and again within minutes, so
+    most queries are settled by a few dozen dot products. Any gallery change
+    clears every shortlist, so a stale embedding is never accepted.
+    """
+
+    def __init__(self, size=RECENT_MATCHES_SIZE, margin=RECENT_MATCH_MARGIN, max_kiosks=RECENT_MATCH_MAX_KIOSKS):
+        self.size = size
+        self.margin = margin
+        self.max_kiosks = max_kiosks
+        self._kiosks = OrderedDict()  # kiosk -> OrderedDict(employee_id -> (name, vector))
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def match(self, kiosk, embedding, threshold):
+        """(employee_id, name, score) of a confident shortlist match, or None to search the full gallery"""
+        if self.size <= 0:
+            return None
+        with self._lock:
+            self.lookups += 1
+            entries = self._kiosks.get(kiosk)
+            if not entries:
+                return None
+            ids = list(entries)
+            names = [entries[employee_id][0] for employee_id in ids]
+            matrix = np.vstack([entries[employee_id][1] for employee_id in ids])
+        scores = matrix @ normalize_embedding(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < threshold + self.margin:
+            return None
+        with self._lock:
+            self.hits += 1
+            if ids[best] in entries:
+                entries.move_to_end(ids[best])
+        return ids[best], names[best], float(scores[best])
+
+    def remember(self, kiosk, employee_id, name, vector):
+        if self.size <= 0:
+            return
+        with self._lock:
+            entries = self._kiosks.get(kiosk)
+            if entries is None:
+                entries = self._kiosks[kiosk] = OrderedDict()
+                if len(self._kiosks) > self.max_kiosks:
+                    self._kiosks.popitem(last=False)
+            self._kiosks.move_to_end(kiosk)
+            entries[employee_id] = (name, vector)
+            entries.move_to_end(employee_id)
+            if len(entries) > self.size:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._kiosks.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "kiosks": len(self._kiosks),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0,
+            }
+
+
+recent_matches = RecentMatches()
+gallery.add_listener(recent_matches.clear)
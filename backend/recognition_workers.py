@@ -0,0 +1,143 @@
+# recognition_workers.py
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from face_gallery import gallery
+from recognize_module import recognize_image_bytes, recognize_aligned_crop, identify_image_bytes, identify_aligned_crop, complete_attendance
+from frame_gate import frame_gate
+
+# Number of recognition processes; 0 keeps recognition inside the API process
+RECOGNITION_PROCESSES = int(os.environ.get('RECOGNITION_PROCESSES', 0))
+# Pin each recognition process to its own core (Linux only)
+PIN_CORES = os.environ.get('RECOGNITION_PIN_CORES', '1') == '1'
+
+_pool = None
+_warm_up_futures = []
+# Shared counter, bumped by the API process whenever the gallery changes
+_gallery_generation = None
+
+# State of a worker process
+_worker_generation = None
+_seen_generation = 0
+
+
+def _init_worker(generation, next_core):
+    """Runs once in every worker: pin to a core, load the models and map the gallery snapshot"""
+    global _worker_generation, _seen_generation
+    _worker_generation = generation
+    _seen_generation = generation.value
+    if PIN_CORES and hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        with next_core.get_lock():
+            index = next_core.value
+            next_core.value += 1
+        core = cores[index % len(cores)]
+        os.sched_setaffinity(0, {core})
+        print(f"[WORKERS] Recognition process {os.getpid()} pinned to core {core}")
+    import model_registry
+    # Workers only recognize; the MediaPipe detectors used by registration stay in the API process
+    model_registry.warm_up(before_ready=[gallery.preload], with_mediapipe=False)
+
+
+def _worker_ready():
+    import model_registry
+    if model_registry.warm_up_error:
+        raise RuntimeError(model_registry.warm_up_error)
+    return model_registry.is_ready()
+
+
+def _sync_gallery():
+    global _seen_generation
+    generation = _worker_generation.value
+    if generation != _seen_generation:
+        # The API process wrote the new snapshot and index before bumping the counter,
+        # so the next match only re-maps them
+        gallery.invalidate()
+        _seen_generation = generation
+
+
+# Workers only identify faces; attendance is marked back in the API process, which owns
+# the debounce window and clears it on punch-out
+
+def _worker_identify(contents, kiosk_id=None):
+    _sync_gallery()
+    return identify_image_bytes(contents, kiosk_id)
+
+
+def _worker_identify_aligned(contents, landmarks=None, kiosk_id=None):
+    _sync_gallery()
+    return identify_aligned_crop(contents, landmarks, kiosk_id)
+
+
+def _on_gallery_change():
+    with _gallery_generation.get_lock():
+        _gallery_generation.value += 1
+
+
+def enabled():
+    return RECOGNITION_PROCESSES > 0
+
+
+def start():
+    """Start the recognition processes (no-op unless RECOGNITION_PROCESSES > 0)"""
+    global _pool, _gallery_generation
+    if not enabled() or _pool is not None:
+        return
+    context = multiprocessing.get_context('spawn')
+    _gallery_generation = context.Value('q', 0)
+    next_core = context.Value('i', 0)
+    _pool = ProcessPoolExecutor(
+        max_workers=RECOGNITION_PROCESSES,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(_gallery_generation, next_core),
+    )
+    gallery.add_listener(_on_gallery_change)
+    # Submitting one job per process makes the pool spawn (and warm up) all of them now
+    _warm_up_futures[:] = [_pool.submit(_worker_ready) for _ in range(RECOGNITION_PROCESSES)]
+    print(f"[WORKERS] Started {RECOGNITION_PROCESSES} recognition processes")
+
+
+def is_ready():
+    if not enabled():
+        return True
+    return bool(_warm_up_futures) and all(
+        future.done() and not future.exception() and future.result() for future in _warm_up_futures
+    )
+
+
+def warm_up_error():
+    """Why a recognition process failed to warm up, or None"""
+    for future in _warm_up_futures:
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            return f"Recognition process warm-up failed: {future.exception()}"
+    return None
+
+
+def recognize(contents, kiosk_id=None, gate_key=None):
+    """Recognize an uploaded frame in a worker process, or in-process when workers are disabled.
+    Frames that show the same scene as the last one recognized for `gate_key` get that result back."""
+    thumb, cached = frame_gate.check(gate_key, contents)
+    if cached is not None:
+        return cached
+    if _pool is None:
+        result = recognize_image_bytes(contents, kiosk_id)
+    else:
+        result = complete_attendance(_pool.submit(_worker_identify, contents, kiosk_id).result())
+    frame_gate.update(gate_key, thumb, result)
+    return result
+
+
+def recognize_aligned(contents, landmarks=None, kiosk_id=None):
+    """Recognize a kiosk-aligned face crop, in a worker process when workers are enabled"""
+    if _pool is None:
+        return recognize_aligned_crop(contents, landmarks, kiosk_id)
+    return complete_attendance(_pool.submit(_worker_identify_aligned, contents, landmarks, kiosk_id).result())
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
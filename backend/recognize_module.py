@@ -1,21 +1,42 @@
 # recognize_module.py
 
 import cv2
-import pickle
+import time
+import threading
 import numpy as np
-from datetime import datetime, timedelta
-from insightface.app import FaceAnalysis
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
 import os
-from database import get_db_connection, get_all_face_embeddings, get_office_settings, get_employee_email
-import smtplib
-from email.mime.text import MIMEText
+from database import punch_in_employee, claim_attendance_event
+from face_gallery import gallery
+from face_pipeline import get_faces, align_face, embed_crops
+from liveness import liveness_checker, LIVENESS_RETRY_AFTER
+from image_ingest import decode_upload
+from recent_matches import recent_matches
+from mail_outbox import queue_email
+from reference_data import reference_data
 
 # Lower threshold for better recognition with variations
 THRESHOLD = 0.6  # Reduced from 0.8 to handle masks, rotation, etc.
 
-# InsightFace setup
-app = FaceAnalysis(name="buffalo_l", providers=['CPUExecutionProvider'])
-app.prepare(ctx_id=0, det_size=(640, 640))
+# Image variants of a frame without a detectable face are evaluated concurrently on a
+# bounded pool; the first one with a face wins and the whole search is capped in time
+VARIANT_WORKERS = int(os.environ.get('FACE_VARIANT_WORKERS', 4))
+VARIANT_BUDGET_MS = float(os.environ.get('FACE_VARIANT_BUDGET_MS', 1500))
+_variant_pool = ThreadPoolExecutor(max_workers=VARIANT_WORKERS, thread_name_prefix="face-variant")
+# Per-variant attempts/hits, to find variants that never help
+variant_stats = defaultdict(lambda: {"attempts": 0, "hits": 0})
+_variant_stats_lock = threading.Lock()
+
+# Repeated recognitions of the same employee within this many seconds get the previous
+# outcome back without touching the database or the mailer
+ATTENDANCE_DEBOUNCE_S = float(os.environ.get('ATTENDANCE_DEBOUNCE_S', 30))
+_recent_outcomes = {}  # employee id -> (time, outcome)
+_recent_outcomes_lock = threading.Lock()
+debounce_stats = {"hits": 0, "misses": 0}
+# Bumped whenever a debounced outcome is dropped, so streaming sessions re-check their tracks
+_outcome_resets = 0
 
 def cosine_similarity(a, b):
     """Calculate cosine similarity between two vectors"""
@@ -24,200 +45,306 @@ def cosine_similarity(a, b):
     norm_b = b / np.linalg.norm(b)
     return np.dot(norm_a, norm_b)
 
+def rotate_image(image_np, angle):
+    height, width = image_np.shape[:2]
+    center = (width // 2, height // 2)
+    rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    return cv2.warpAffine(image_np, rotation_matrix, (width, height))
+
+def scale_image(image_np, scale):
+    height, width = image_np.shape[:2]
+    new_height, new_width = int(height * scale), int(width * scale)
+    resized = cv2.resize(image_np, (new_width, new_height))
+    start_y = max(0, (new_height - height) // 2)
+    start_x = max(0, (new_width - width) // 2)
+    return resized[start_y:start_y + height, start_x:start_x + width]
+
+# Only a few essential variations for speed, tried when the original frame has no face
+IMAGE_VARIANTS = [
+    ("rotate_-10", lambda image_np: rotate_image(image_np, -10)),
+    ("rotate_10", lambda image_np: rotate_image(image_np, 10)),
+    ("scale_0.95", lambda image_np: scale_image(image_np, 0.95)),
+    ("scale_1.05", lambda image_np: scale_image(image_np, 1.05)),
+]
+
 def preprocess_image_for_recognition(image_np):
-    processed_images = [image_np]
-    # Only a few essential variations for speed
-    for angle in [-10, 10]:
-        height, width = image_np.shape[:2]
-        center = (width // 2, height // 2)
-        rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-        rotated = cv2.warpAffine(image_np, rotation_matrix, (width, height))
-        processed_images.append(rotated)
-    for scale in [0.95, 1.05]:
-        height, width = image_np.shape[:2]
-        new_height, new_width = int(height * scale), int(width * scale)
-        resized = cv2.resize(image_np, (new_width, new_height))
-        start_y = max(0, (new_height - height) // 2)
-        start_x = max(0, (new_width - width) // 2)
-        cropped = resized[start_y:start_y + height, start_x:start_x + width]
-        processed_images.append(cropped)
-    return processed_images
-
-def recognize_face_with_variations(embedding):
-    """Enhanced face recognition that tries multiple variations"""
-    # Get embeddings from database
-    db = get_all_face_embeddings()
-    if not db:
+    return [image_np] + [make_variant(image_np) for _, make_variant in IMAGE_VARIANTS]
+
+def _detect_in_variant(image_np, make_variant):
+    variant = make_variant(image_np)
+    return variant, get_faces(variant, limit=1)
+
+def _record_variant(variant_name, found):
+    with _variant_stats_lock:
+        stats = variant_stats[variant_name]
+        stats["attempts"] += 1
+        stats["hits"] += int(found)
+
+def find_face_in_variants(image_np):
+    """Try all image variants concurrently and return (variant_name, variant_image, face) for the
+    first one that contains a face, or (None, None, None) if none does within VARIANT_BUDGET_MS"""
+    deadline = time.monotonic() + VARIANT_BUDGET_MS / 1000.0
+    futures = {_variant_pool.submit(_detect_in_variant, image_np, make_variant): variant_name
+               for variant_name, make_variant in IMAGE_VARIANTS}
+    pending = set(futures)
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"[DEBUG] Variant time budget of {VARIANT_BUDGET_MS:.0f} ms exhausted")
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                variant_name = futures[future]
+                try:
+                    variant, faces = future.result()
+                except Exception as e:
+                    print(f"[DEBUG] Variation {variant_name} failed: {e}")
+                    continue
+                _record_variant(variant_name, bool(faces))
+                if faces:
+                    return variant_name, variant, faces[0]
+        return None, None, None
+    finally:
+        # Variants that haven't started yet are dropped, running ones finish in the background
+        for future in pending:
+            future.cancel()
+
+def match_employee(embedding, kiosk_id: str = None):
+    """Identify an embedding, returns (employee_id, name, score) or (None, None, 0)"""
+    # People recently recognized at this kiosk are checked first, with a safety margin
+    shortlisted = recent_matches.match(kiosk_id, embedding, THRESHOLD)
+    if shortlisted is not None:
+        best_id, best_name, best_score = shortlisted
+        print(f"[DEBUG] Recent match at kiosk {kiosk_id}: {best_name} ({best_id}) with score: {best_score:.4f}")
+        return best_id, best_name, best_score
+
+    # Match against the process-resident gallery instead of reloading the database
+    match = gallery.match_with_vector(embedding)
+    if match is None:
         print("[DEBUG] No face embeddings found in database")
-        return None, 0
-    
-    embeddings_list = list(db.values())
-    names_list = list(db.keys())
-    
-    print(f"[DEBUG] Comparing against {len(names_list)} registered faces: {names_list}")
-    
-    # Calculate cosine similarities
-    similarities = []
-    for stored_embedding in embeddings_list:
-        similarity = cosine_similarity(embedding, stored_embedding)
-        similarities.append(similarity)
-    
-    similarities = np.array(similarities)
-    best_match_index = np.argmax(similarities)
-    best_score = similarities[best_match_index]
-    best_name = names_list[best_match_index]
+        return None, None, 0
     
-    print(f"[DEBUG] Best match: {best_name} with score: {best_score:.4f} (threshold: {THRESHOLD})")
+    best_id, best_name, best_score, best_vector = match
+    print(f"[DEBUG] Compared against {len(gallery)} registered faces")
+    print(f"[DEBUG] Best match: {best_name} ({best_id}) with score: {best_score:.4f} (threshold: {THRESHOLD})")
     
     if best_score > THRESHOLD:
         print(f"[DEBUG] Face recognized as: {best_name}")
-        return best_name, best_score
+        recent_matches.remember(kiosk_id, best_id, best_name, best_vector)
+        return best_id, best_name, best_score
     else:
         print(f"[DEBUG] Face not recognized - best score {best_score:.4f} below threshold {THRESHOLD}")
-        return None, 0
+        return None, None, 0
+
+def recognize_face_with_variations(embedding, kiosk_id: str = None):
+    """Enhanced face recognition that tries multiple variations"""
+    _, name, score = match_employee(embedding, kiosk_id)
+    return name, score
 
 def recognize_face(embedding):
     """Legacy function for backward compatibility"""
     return recognize_face_with_variations(embedding)
 
-def get_attendance_status(employee_name: str, date: str):
-    """Check if attendance exists and if punch-out has occurred."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT check_in, check_out FROM attendance 
-            WHERE employee_id = (SELECT id FROM employees WHERE name = ?) 
-            AND date = ?
-        """, (employee_name, date))
-        result = cur.fetchone()
-        print(f"[DEBUG] Database query result for {employee_name} on {date}: {result}")
-        if result:
-            status = {"checked_in": True, "checked_out": result[1] is not None}
-            print(f"[DEBUG] Attendance status for {employee_name}: {status}")
-            return status
-        print(f"[DEBUG] No attendance record found for {employee_name} on {date}")
-        return {"checked_in": False, "checked_out": False}
-    except Exception as e:
-        print(f"Error checking attendance status: {e}")
-        return None
-    finally:
-        cur.close()
-        conn.close()
+def decode_frame(contents: bytes):
+    """Decode an uploaded JPEG/PNG frame to a BGR array sized for the detector, or None if it isn't an image"""
+    return decode_upload(contents)[0]
 
-def log_attendance(employee_name: str, status: str):
-    """Log attendance in the database"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # Use Python datetime to get local time instead of SQLite's UTC time
-        now = datetime.now()
-        current_time = now.strftime('%H:%M:%S')
-        current_date = now.strftime('%Y-%m-%d')
-        
-        cur.execute("""
-            INSERT INTO attendance (employee_id, check_in, status, date)
-            VALUES ((SELECT id FROM employees WHERE name = ?), ?, ?, ?)
-        """, (employee_name, current_time, status, current_date))
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"Error logging attendance: {e}")
-        conn.rollback()
-        return False
-    finally:
-        cur.close()
-        conn.close()
+def identify_image_bytes(contents: bytes, kiosk_id: str = None):
+    """Decode an uploaded frame and identify the face in it, without marking attendance"""
+    frame = decode_frame(contents)
+    
+    if frame is None:
+        return {"status": "error", "message": "Invalid image"}
+
+    return identify_image(frame, kiosk_id)
+
+def recognize_image_bytes(contents: bytes, kiosk_id: str = None):
+    """Decode an uploaded frame and run recognition on it"""
+    return complete_attendance(identify_image_bytes(contents, kiosk_id))
+
+SPOOF_RESULT = {"name": None, "message": "Liveness check failed - please present your face, not a photo or screen", "status": "Spoof"}
+UNKNOWN_RESULT = {"name": None, "message": "Unknown Face - Please register first", "status": "Unknown"}
+# The liveness check could not run in time (server overloaded) or failed; not a spoof verdict
+LIVENESS_UNAVAILABLE_RESULT = {"name": None, "message": "Liveness check unavailable - please try again",
+                               "status": "Liveness Unavailable", "retry_after": LIVENESS_RETRY_AFTER}
+# Status of a recognized face whose attendance hasn't been marked yet
+IDENTIFIED = "Identified"
+
+def identify_face(image_np: np.ndarray, face, kiosk_id: str = None):
+    """Liveness-check and match an embedded face, returns (is_live, employee_id, name, score).
+    is_live is None when the check could not run, see LivenessChecker.verdict."""
+    # The anti-spoof model runs on the face crop while the gallery is searched
+    liveness = liveness_checker.submit(image_np, [face], kiosk_id)
+    employee_id, name, score = match_employee(face.embedding, kiosk_id)
+    is_live, _ = liveness_checker.verdict(liveness)
+    return is_live, employee_id, name, score
+
+def identify_detected_face(image_np: np.ndarray, face, kiosk_id: str = None):
+    """Liveness-check and identify a detected face without marking attendance.
+    A recognized employee comes back with status IDENTIFIED, see complete_attendance."""
+    is_live, employee_id, name, score = identify_face(image_np, face, kiosk_id)
+    if is_live is None:
+        return dict(LIVENESS_UNAVAILABLE_RESULT)
+    if not is_live:
+        return dict(SPOOF_RESULT)
+
+    if name:
+        return {"status": IDENTIFIED, "employee_id": employee_id, "name": name, "score": float(score)}
+    else:
+        # Face detected, but not recognized
+        return dict(UNKNOWN_RESULT)
 
-def recognize_and_log_image(image_np: np.ndarray):
+def complete_attendance(result: dict):
+    """Mark attendance for an identified employee; any other result is returned unchanged.
+    Runs in the API process, so the debounce and punch-out resets see every kiosk."""
+    if result.get("status") == IDENTIFIED:
+        return process_attendance(result["employee_id"], result["name"], result["score"])
+    return result
+
+def recognize_detected_face(image_np: np.ndarray, face, kiosk_id: str = None):
+    """Liveness-check and identify a detected face, then mark attendance"""
+    return complete_attendance(identify_detected_face(image_np, face, kiosk_id))
+
+def landmark_box(kps, width, height):
+    """Approximate face box around 5-point landmarks, with the proportions of the
+    ArcFace alignment template (eyes ~46% and mouth ~82% down the box), clipped to the image"""
+    (x1, y1), (x2, y2) = kps.min(axis=0), kps.max(axis=0)
+    span_x, span_y = max(x2 - x1, 1.0), max(y2 - y1, 1.0)
+    return np.array([max(0.0, x1 - 1.1 * span_x), max(0.0, y1 - 1.3 * span_y),
+                     min(float(width), x2 + 1.1 * span_x), min(float(height), y2 + 0.5 * span_y)], dtype=np.float32)
+
+def recognize_aligned_crop(contents: bytes, landmarks=None, kiosk_id: str = None):
+    """Recognize a face crop prepared by the kiosk and mark attendance"""
+    return complete_attendance(identify_aligned_crop(contents, landmarks, kiosk_id))
+
+def identify_aligned_crop(contents: bytes, landmarks=None, kiosk_id: str = None):
+    """Identify a face crop prepared by the kiosk, skipping server-side detection.
+    With 5-point landmarks (pixel coordinates in the image) the face is aligned here and
+    the liveness check sees the face with the context around it. A bare 112x112 aligned
+    crop is too tight for the anti-spoof model, so it is only accepted from kiosks that
+    skip the liveness check."""
+    from insightface.app.common import Face
+
+    image, scale = decode_upload(contents)
+    if image is None:
+        return {"status": "error", "message": "Invalid image"}
+    height, width = image.shape[:2]
+    if landmarks is not None:
+        # Landmarks refer to the uploaded pixels, which an oversized upload no longer has
+        kps = np.asarray(landmarks, dtype=np.float32).reshape(5, 2) * scale
+        crop = align_face(image, kps)
+        bbox = landmark_box(kps, width, height)
+    elif (height, width) == (112, 112):
+        if liveness_checker.applies(kiosk_id):
+            return {"status": "error", "message": "Liveness check needs a face crop with context and its landmarks, not an aligned 112x112 crop"}
+        kps, crop = None, image
+        bbox = np.array([0, 0, width, height], dtype=np.float32)
+    else:
+        return {"status": "error", "message": "Expected a 112x112 aligned face crop or 5-point landmarks"}
+
+    face = Face(bbox=bbox, kps=kps, det_score=1.0)
+    face.embedding = embed_crops([crop])[0]
+    return identify_detected_face(image, face, kiosk_id)
+
+def recognize_and_log_image(image_np: np.ndarray, kiosk_id: str = None):
     """Enhanced recognition with multiple attempts and variations"""
+    return complete_attendance(identify_image(image_np, kiosk_id))
+
+def identify_image(image_np: np.ndarray, kiosk_id: str = None):
+    """Find and identify the face in a frame, trying preprocessed variants if none is detected"""
     print("[DEBUG] Starting enhanced face recognition...")
     
     # Try original image first
-    faces = app.get(image_np)
+    faces = get_faces(image_np, limit=1)
     if faces:
-        face = faces[0]
-        emb = face.embedding
-        name, score = recognize_face_with_variations(emb)
-        
-        if name:
-            return process_attendance(name, score)
-        else:
-            # Face detected, but not recognized
-            return {"name": None, "message": "Unknown Face - Please register first", "status": "Unknown"}
+        return identify_detected_face(image_np, faces[0], kiosk_id)
     
     # If original failed, try preprocessed variations
     print("[DEBUG] Original image failed, trying variations...")
-    processed_images = preprocess_image_for_recognition(image_np)
-    face_found = False
-    for i, processed_img in enumerate(processed_images):
-        try:
-            faces = app.get(processed_img)
-            if faces:
-                face_found = True
-                face = faces[0]
-                emb = face.embedding
-                name, score = recognize_face_with_variations(emb)
-                if name:
-                    return process_attendance(name, score)
-                else:
-                    # Face detected, but not recognized
-                    return {"name": None, "message": "Unknown Face - Please register first", "status": "Unknown"}
-        except Exception as e:
-            print(f"[DEBUG] Variation {i} failed: {e}")
-            continue
-    if not face_found:
+    variant_name, variant, face = find_face_in_variants(image_np)
+    if face is None:
         print("[DEBUG] No face detected in any variation.")
         return {"name": None, "message": "No face detected. Please try again.", "status": "No Face"}
 
-def process_attendance(name: str, score: float):
-    """Process attendance for recognized employee"""
+    print(f"[DEBUG] Face found in variation {variant_name}")
+    return identify_detected_face(variant, face, kiosk_id)
+
+def attendance_event_key(employee_id: str, date: str, event: str):
+    """Idempotency key of an attendance side effect: at most one per employee, day and event.
+    Keyed by id, since two employees may share a name."""
+    return f"{date}|{event}|{employee_id}"
+
+def _first_occurrence(employee_id: str, name: str, date: str, event: str):
+    """True the first time an event happens for an employee on a day, across retries and processes"""
+    return claim_attendance_event(attendance_event_key(employee_id, date, event), name, event, date)
+
+def _debounced_outcome(employee_id: str):
+    with _recent_outcomes_lock:
+        entry = _recent_outcomes.get(employee_id)
+        if entry is not None and time.monotonic() - entry[0] < ATTENDANCE_DEBOUNCE_S:
+            debounce_stats["hits"] += 1
+            return dict(entry[1])
+        debounce_stats["misses"] += 1
+        return None
+
+def _remember_outcome(employee_id: str, outcome: dict):
+    now = time.monotonic()
+    with _recent_outcomes_lock:
+        for stale in [key for key, (at, _) in _recent_outcomes.items() if now - at >= ATTENDANCE_DEBOUNCE_S]:
+            del _recent_outcomes[stale]
+        _recent_outcomes[employee_id] = (now, dict(outcome))
+
+def forget_attendance_outcome(name: str):
+    """Drop the debounced outcome of an employee, e.g. after they punched out"""
+    global _outcome_resets
+    with _recent_outcomes_lock:
+        _outcome_resets += 1
+        for employee_id in [key for key, (_, outcome) in _recent_outcomes.items() if outcome.get("name") == name]:
+            del _recent_outcomes[employee_id]
+
+def attendance_outcome_resets():
+    """How often debounced outcomes were dropped; a change means earlier results may be stale"""
+    return _outcome_resets
+
+def process_attendance(employee_id: str, name: str, score: float):
+    """Process attendance for recognized employee, debounced per employee"""
+    outcome = _debounced_outcome(employee_id)
+    if outcome is not None:
+        print(f"[DEBUG] {name} recognized again within {ATTENDANCE_DEBOUNCE_S:.0f}s, returning previous outcome")
+        return outcome
+    outcome = _process_attendance(employee_id, name, score)
+    if outcome["status"] != "Error":
+        _remember_outcome(employee_id, outcome)
+    return outcome
+
+def check_in_status(current_time):
+    """'On Time' or 'Late' for a check-in at `current_time` under the cached office settings"""
+    return "Late" if current_time > reference_data.office_settings().on_time_limit else "On Time"
+
+def _process_attendance(employee_id: str, name: str, score: float):
     now = datetime.now()
     today = now.strftime("%Y-%m-%d")
-    print(f"[DEBUG] Employee {name} detected on {today} with confidence: {score:.4f}")
-    attendance_status = get_attendance_status(name, today)
-    print(f"[DEBUG] Attendance status: {attendance_status}")
-
-    # Fetch on_time_limit from office_settings
-    settings = get_office_settings()
-    
-    # Default values
-    start_time_str = "09:00:00"
-    on_time_limit_val = "15" # Default 15 minutes grace
-    
-    if settings:
-        start_time_str = settings.get('start_time', "09:00:00")
-        on_time_limit_val = settings.get('on_time_limit', "15")
+    print(f"[DEBUG] Employee {name} ({employee_id}) detected on {today} with confidence: {score:.4f}")
+    # Employee and today's attendance row are read and the check-in written in a
+    # single transaction, so concurrent kiosks can't both check someone in
+    punch = punch_in_employee(employee_id, today, now.strftime('%H:%M:%S'), check_in_status(now.time()))
+    print(f"[DEBUG] Punch result: {punch}")
 
-    try:
-        # First, try to parse as a full time string (HH:MM:SS)
-        on_time_limit = datetime.strptime(on_time_limit_val, "%H:%M:%S").time()
-    except ValueError:
-        # If that fails, assume it's a number of minutes from start_time
-        try:
-            minutes = int(on_time_limit_val)
-            # Handle start_time format which might be HH:MM or HH:MM:SS
-            try:
-                start_time = datetime.strptime(start_time_str, "%H:%M:%S")
-            except ValueError:
-                start_time = datetime.strptime(start_time_str, "%H:%M")
-                
-            on_time_limit_dt = start_time + timedelta(minutes=minutes)
-            on_time_limit = on_time_limit_dt.time()
-        except Exception as e:
-            # Fallback if everything fails
-            print(f"[WARNING] Could not parse on_time_limit: {on_time_limit_val}. Error: {e}. Using default 09:30:00")
-            on_time_limit = datetime.strptime("09:30:00", "%H:%M:%S").time()
-
-    if attendance_status and attendance_status["checked_in"]:
+    if punch is None:
+        message = f"{name}: Error logging attendance"
+        status = "Error"
+        print(f"[DEBUG] Error logging check-in")
+    elif not punch["created"]:
+        name = punch["name"]
         print(f"[DEBUG] {name} is checked in.")
-        if attendance_status["checked_out"]:
+        if punch["checked_out"]:
             print(f"[DEBUG] {name} is already checked out.")
             message = f"{name}: Already punched out for the day."
             status = "Already Punched Out"
             print(f"[DEBUG] Employee already punched out")
-            # Send punch-out email
-            email = get_employee_email(name)
+            # Send punch-out email, once per day however often the employee is scanned afterwards
+            email = punch["email"] if _first_occurrence(employee_id, name, today, "punch_out_email") else None
             if email:
                 send_email(
                     email,
@@ -230,45 +357,23 @@ def process_attendance(name: str, score: float):
             status = "Already Marked"
             print(f"[DEBUG] Employee checked in but not out - showing punch-out modal")
     else:
-        print(f"[DEBUG] {name} is not checked in today. Logging new check-in.")
-        current_time = now.time()
-        check_in_status = "Late" if current_time > on_time_limit else "On Time"
-        print(f"[DEBUG] New check-in for {name} - status: {check_in_status}")
-        if log_attendance(name, check_in_status):
-            message = f"{name}: Attendance marked ({check_in_status})"
-            status = "Success"
-            print(f"[DEBUG] Check-in logged successfully")
-            # Send punch-in email
-            email = get_employee_email(name)
-            if email:
-                send_email(
-                    email,
-                    f"Punch In Confirmation - {today}",
-                    f"Hello {name},\n\nYou have successfully punched in at {now.strftime('%H:%M:%S')} on {today}.\n\nStatus: {check_in_status}\n\nThank you."
-                )
-        else:
-            message = f"{name}: Error logging attendance"
-            status = "Error"
-            print(f"[DEBUG] Error logging check-in")
+        name = punch["name"]
+        punch_status = punch["status"]
+        message = f"{name}: Attendance marked ({punch_status})"
+        status = "Success"
+        print(f"[DEBUG] Check-in logged successfully - status: {punch_status}")
+        # Send punch-in email; the check-in row is only ever created once per day
+        email = punch["email"]
+        if email:
+            send_email(
+                email,
+                f"Punch In Confirmation - {today}",
+                f"Hello {name},\n\nYou have successfully punched in at {now.strftime('%H:%M:%S')} on {today}.\n\nStatus: {punch_status}\n\nThank you."
+            )
 
     print(f"[DEBUG] Returning: name={name}, message={message}, status={status}")
-    return {"name": name, "message": message, "status": status}
+    return {"name": name, "message": message, "status": status, "event_id": attendance_event_key(employee_id, today, status)}
 
 def send_email(to_email, subject, body):
-    smtp_server = os.environ.get('SMTP_SERVER', 'smtp.example.com')
-    smtp_port = int(os.environ.get('SMTP_PORT', 587))
-    smtp_user = os.environ.get('SMTP_USER', 'your@email.com')
-    smtp_password = os.environ.get('SMTP_PASSWORD', 'yourpassword')
-    from_email = smtp_user
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = from_email
-    msg['To'] = to_email
-    try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.sendmail(from_email, [to_email], msg.as_string())
-        print(f"[EMAIL] Sent to {to_email}")
-    except Exception as e:
-        print(f"[EMAIL ERROR] {e}")
+    """Queue an email in the outbox; delivery happens on the background sender, off the kiosk path"""
+    queue_email(to_email, subject, body)
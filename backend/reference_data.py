@@ -0,0 +1,172 @@
+# reference_data.py
+
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from database import get_db_connection
+from face_gallery import gallery
+
+# Cached tables are reloaded at least this often, so writes made by other processes
+# (recognition workers, setup scripts) show up without an explicit invalidation
+REFERENCE_CACHE_TTL_S = float(os.environ.get('REFERENCE_CACHE_TTL_S', 60))
+
+TABLES = ("office_settings", "holidays", "employees")
+
+OfficeSettings = namedtuple("OfficeSettings", "start_time end_time on_time_limit raw")
+HolidayYear = namedtuple("HolidayYear", "holidays working_days")
+EmployeeRecord = namedtuple("EmployeeRecord", "id name email department employee_type gender joining_date")
+
+
+def parse_on_time_limit(start_time_str, on_time_limit_val):
+    """Latest on-time check-in: `on_time_limit` is either a time of day or minutes after `start_time`"""
+    try:
+        # First, try to parse as a full time string (HH:MM:SS)
+        return datetime.strptime(on_time_limit_val, "%H:%M:%S").time()
+    except ValueError:
+        # If that fails, assume it's a number of minutes from start_time
+        try:
+            minutes = int(on_time_limit_val)
+            # Handle start_time format which might be HH:MM or HH:MM:SS
+            try:
+                start_time = datetime.strptime(start_time_str, "%H:%M:%S")
+            except ValueError:
+                start_time = datetime.strptime(start_time_str, "%H:%M")
+
+            on_time_limit_dt = start_time + timedelta(minutes=minutes)
+            return on_time_limit_dt.time()
+        except Exception as e:
+            # Fallback if everything fails
+            print(f"[WARNING] Could not parse on_time_limit: {on_time_limit_val}. Error: {e}. Using default 09:30:00")
+            return datetime.strptime("09:30:00", "%H:%M:%S").time()
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+
+def _load_office_settings():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT start_time, end_time, on_time_limit FROM office_settings ORDER BY id LIMIT 1")
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    # Default values
+    start_time_str, end_time_str, on_time_limit_val = "09:00:00", None, "15"  # 15 minutes grace
+    raw = None
+    if row:
+        raw = {'start_time': str(row[0]), 'end_time': str(row[1]), 'on_time_limit': str(row[2])}
+        start_time_str, end_time_str, on_time_limit_val = raw['start_time'], raw['end_time'], raw['on_time_limit']
+    return OfficeSettings(start_time_str, end_time_str, parse_on_time_limit(start_time_str, on_time_limit_val), raw)
+
+
+def _load_holidays(year):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT date, name, type FROM holidays WHERE strftime('%Y', date) = ?", (str(year),))
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+    holidays, working_days = {}, set()
+    for date_str, name, holiday_type in rows:
+        day = _parse_date(date_str)
+        if day is None:
+            continue
+        if holiday_type == 'WORKING_DAY':
+            working_days.add(day)
+        else:
+            holidays[day] = name
+    return HolidayYear(holidays, frozenset(working_days))
+
+
+def _load_employees():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, name, email, department, employee_type, gender, joining_date FROM employees")
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+    return tuple(EmployeeRecord(row[0], row[1], row[2], row[3], row[4], row[5], _parse_date(row[6])) for row in rows)
+
+
+class ReferenceData:
+    """In-process cache of the read-mostly tables: office settings (with the on-time
+    limit already parsed), holidays and converted working days per year, and the
+    employee directory.
+
+    Every table has a version that write endpoints bump through invalidate(); a load
+    that raced with an invalidation is returned but not cached.
+    """
+
+    def __init__(self, ttl=REFERENCE_CACHE_TTL_S):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = {table: 0 for table in TABLES}
+        self._entries = {}  # (table, key) -> (version, loaded_at, value)
+        self._counts = {table: {"hits": 0, "misses": 0} for table in TABLES}
+
+    def _get(self, table, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            version = self._versions[table]
+            entry = self._entries.get((table, key))
+            if entry is not None and entry[0] == version and now - entry[1] < self.ttl:
+                self._counts[table]["hits"] += 1
+                return entry[2]
+            self._counts[table]["misses"] += 1
+        value = loader()
+        with self._lock:
+            if self._versions[table] == version:
+                self._entries[(table, key)] = (version, now, value)
+        return value
+
+    def office_settings(self):
+        return self._get("office_settings", None, _load_office_settings)
+
+    def holidays(self, year):
+        """HolidayYear of `year`: {date: name} of holidays and the set of weekend dates turned into working days"""
+        return self._get("holidays", int(year), lambda: _load_holidays(year))
+
+    def holidays_between(self, start_date, end_date):
+        """{date: name} of the holidays from `start_date` to `end_date` inclusive"""
+        holidays = {}
+        for year in range(start_date.year, end_date.year + 1):
+            holidays.update((day, name) for day, name in self.holidays(year).holidays.items()
+                            if start_date <= day <= end_date)
+        return holidays
+
+    def employees(self):
+        """Every employee as an EmployeeRecord, in table order"""
+        return self._get("employees", None, _load_employees)
+
+    def invalidate(self, *tables):
+        """Drop the cached copies of `tables` (all of them by default) after a write"""
+        with self._lock:
+            for table in tables or TABLES:
+                self._versions[table] += 1
+                for key in [key for key in self._entries if key[0] == table]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            stats = {table: dict(counts, version=self._versions[table]) for table, counts in self._counts.items()}
+        for counts in stats.values():
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = round(counts["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+reference_data = ReferenceData()
+# Enrollment, renames and removals change the employee directory as well as the gallery
+gallery.add_listener(lambda: reference_data.invalidate("employees"))
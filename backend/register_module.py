@@ -1,28 +1,38 @@
 import os
-import cv2
 import base64
-import pickle
+import hashlib
+import threading
 import numpy as np
-import mediapipe as mp
+from collections import OrderedDict
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from insightface.app import FaceAnalysis
-from sklearn.metrics.pairwise import cosine_similarity
-from database import get_db_connection, save_face_data, get_all_face_embeddings
+from database import get_db_connection, save_face_data, encode_embedding
+from face_gallery import gallery
+from model_registry import detect_faces_mediapipe
+from face_pipeline import detect_faces, augmented_crops, embed_crops, crop_to_box
+from image_ingest import decode_upload
 
 # Initialize router
 router = APIRouter()
 
-# Initialize InsightFace
-embedder = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])
-embedder.prepare(ctx_id=0, det_size=(640, 640))
-
-# Initialize MediaPipe face detection
-mp_face_detection = mp.solutions.face_detection
-
 # Similarity threshold for face comparison
 SIMILARITY_THRESHOLD = 0.7  # Slightly reduced for better registration
 
+# (rotation degrees, scale, horizontal flip) applied to the aligned face crop at enrollment
+ENROLLMENT_AUGMENTATIONS = [
+    (0, 1.0, False),
+    (-10, 1.0, False),
+    (10, 1.0, False),
+    (0, 0.95, False),
+    (0, 1.05, False),
+    (0, 1.0, True),
+]
+
+# The UI validates a photo and then registers the same photo, so keep the last few embeddings
+EMBEDDING_CACHE_SIZE = 32
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
 # Request model
 class RegisterRequest(BaseModel):
     id: str
@@ -43,68 +53,43 @@ class ValidateFaceRequest(BaseModel):
     image_base64: str
 
 def create_robust_embedding(frame):
-    embeddings = []
-    faces = embedder.get(frame)
-    if faces:
-        embeddings.append(faces[0].normed_embedding)
-    for angle in [-10, 10]:
-        height, width = frame.shape[:2]
-        center = (width // 2, height // 2)
-        rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-        rotated = cv2.warpAffine(frame, rotation_matrix, (width, height))
-        faces = embedder.get(rotated)
-        if faces:
-            embeddings.append(faces[0].normed_embedding)
-    for scale in [0.95, 1.05]:
-        height, width = frame.shape[:2]
-        new_height, new_width = int(height * scale), int(width * scale)
-        resized = cv2.resize(frame, (new_width, new_height))
-        start_y = max(0, (new_height - height) // 2)
-        start_x = max(0, (new_width - width) // 2)
-        cropped = resized[start_y:start_y + height, start_x:start_x + width]
-        faces = embedder.get(cropped)
-        if faces:
-            embeddings.append(faces[0].normed_embedding)
-    if not embeddings:
+    """Detect the face once, then embed augmented aligned crops of it in a single batch"""
+    bboxes, kpss = detect_faces(frame)
+    if bboxes.shape[0] == 0:
         raise Exception("Could not extract any embeddings from the image")
+    crops = augmented_crops(frame, kpss[0], ENROLLMENT_AUGMENTATIONS)
+    embeddings = embed_crops(crops)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
     avg_embedding = np.mean(embeddings, axis=0)
     avg_embedding = avg_embedding / np.linalg.norm(avg_embedding)
-    print(f"[DEBUG] Created robust embedding from {len(embeddings)} variations")
+    print(f"[DEBUG] Created robust embedding from {len(crops)} variations")
     return avg_embedding
 
+def get_enrollment_embedding(image_data, frame):
+    """create_robust_embedding, reusing the result when the same image was just validated"""
+    key = hashlib.sha1(image_data).hexdigest()
+    with _embedding_cache_lock:
+        if key in _embedding_cache:
+            _embedding_cache.move_to_end(key)
+            return _embedding_cache[key]
+    embedding = create_robust_embedding(frame)
+    with _embedding_cache_lock:
+        _embedding_cache[key] = embedding
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    return embedding
+
 def check_similar_face(embedding):
     """Check if the face embedding is similar to any existing face in the database"""
     try:
-        # Get all existing face embeddings
-        existing_embeddings = get_all_face_embeddings()
+        match = gallery.match(embedding)
         
-        if not existing_embeddings:
+        if match is None:
             print("[DEBUG] No existing faces in database to compare against")
             return None, 0
         
-        print(f"[DEBUG] Checking against {len(existing_embeddings)} existing faces")
-        
-        # Calculate similarities with existing faces
-        similarities = []
-        names = []
-        
-        for name, stored_embedding in existing_embeddings.items():
-            # Normalize embeddings for proper cosine similarity
-            norm_embedding = embedding / np.linalg.norm(embedding)
-            norm_stored = stored_embedding / np.linalg.norm(stored_embedding)
-            similarity = np.dot(norm_embedding, norm_stored)
-            
-            similarities.append(similarity)
-            names.append(name)
-            
-            print(f"[DEBUG] Similarity with {name}: {similarity:.4f}")
-        
-        # Find the best match
-        best_index = np.argmax(similarities)
-        best_similarity = similarities[best_index]
-        best_name = names[best_index]
-        
-        print(f"[DEBUG] Best match: {best_name} with similarity: {best_similarity:.4f}")
+        _, best_name, best_similarity = match
+        print(f"[DEBUG] Best match among {len(gallery)} existing faces: {best_name} with similarity: {best_similarity:.4f}")
         
         if best_similarity > SIMILARITY_THRESHOLD:
             return best_name, best_similarity
@@ -126,23 +111,21 @@ def register_face(request: RegisterRequest):
 
     try:
         image_data = base64.b64decode(request.image_base64)
-        np_arr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        frame, _ = decode_upload(image_data)
     except Exception:
         raise HTTPException(status_code=400, detail="Failed to decode image.")
 
     if frame is None:
         raise HTTPException(status_code=400, detail="Invalid image data.")
 
-    # Face detection
-    with mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.6) as face_detection:
-        results = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        if not results.detections:
-            raise HTTPException(status_code=400, detail="No face detected.")
+    # Face detection; InsightFace only looks at the region MediaPipe found
+    boxes = detect_faces_mediapipe(frame)
+    if not boxes:
+        raise HTTPException(status_code=400, detail="No face detected.")
 
     # Create robust embedding from multiple variations
     try:
-        embedding = create_robust_embedding(frame)
+        embedding = get_enrollment_embedding(image_data, crop_to_box(frame, boxes[0]))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Could not extract embedding: {str(e)}")
 
@@ -174,7 +157,7 @@ def register_face(request: RegisterRequest):
         
         # Step 3: Save face embedding and image data
         print(f"[DEBUG] Saving face data for ID: {emp_id}")
-        embedding_bytes = pickle.dumps(embedding)
+        embedding_bytes = encode_embedding(embedding)
         cur.execute("""
             UPDATE employees 
             SET face_embedding = ?, photo_data = ?, updated_at = CURRENT_TIMESTAMP
@@ -182,6 +165,7 @@ def register_face(request: RegisterRequest):
         """, (embedding_bytes, image_data, emp_id))
 
         conn.commit()
+        gallery.upsert(emp_id, request.name, embedding)
         print(f"[SUCCESS] Successfully registered employee '{request.name}' with ID '{emp_id}'.")
 
     except Exception as e:
@@ -206,21 +190,19 @@ def validate_face_uniqueness(request: ValidateFaceRequest):
     """
     try:
         image_data = base64.b64decode(request.image_base64)
-        np_arr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        frame, _ = decode_upload(image_data)
     except Exception:
         raise HTTPException(status_code=400, detail="Failed to decode image.")
 
     if frame is None:
         raise HTTPException(status_code=400, detail="Invalid image data.")
         
-    with mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.6) as face_detection:
-        results = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        if not results.detections:
-            raise HTTPException(status_code=400, detail="No face detected in the image.")
+    boxes = detect_faces_mediapipe(frame)
+    if not boxes:
+        raise HTTPException(status_code=400, detail="No face detected in the image.")
 
     try:
-        embedding = create_robust_embedding(frame)
+        embedding = get_enrollment_embedding(image_data, crop_to_box(frame, boxes[0]))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Could not extract face embedding: {str(e)}")
 
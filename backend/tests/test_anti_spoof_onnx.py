@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+
+from export_anti_spoof import export
+from utils.models.mfasnet import MiniFASNetV1SE
+from utils.anti_spoof_input import INPUT_SIZE
+from utils.onnx_anti_spoof_predictor import OnnxAntiSpoofPredictor
+
+
+def test_onnx_export_matches_torch(tmp_path):
+    # Randomly initialised weights, so no pretrained checkpoint is needed
+    torch.manual_seed(0)
+    weights = tmp_path / "anti_spoof.pth"
+    torch.save(MiniFASNetV1SE(input_size=INPUT_SIZE).state_dict(), weights)
+    output = tmp_path / "anti_spoof.onnx"
+
+    predictor = export(str(weights), str(output), opset=13)
+    onnx_predictor = OnnxAntiSpoofPredictor(str(output), max_batch_size=predictor.max_batch_size)
+
+    rng = np.random.default_rng(0)
+    # More crops than one batch, of assorted sizes, plus all-black and all-white ones
+    crops = [rng.integers(0, 256, (int(h), int(w), 3), dtype=np.uint8)
+             for h, w in rng.integers(40, 400, (2 * predictor.max_batch_size + 3, 2))]
+    crops += [np.zeros((80, 80, 3), np.uint8), np.full((80, 80, 3), 255, np.uint8)]
+
+    torch_scores = predictor.predict_batch(crops)
+    onnx_scores = onnx_predictor.predict_batch(crops)
+    np.testing.assert_allclose(onnx_scores, torch_scores, atol=1e-4)
+    single = np.array([onnx_predictor.predict(crop) for crop in crops])
+    np.testing.assert_allclose(single, onnx_scores, atol=1e-5)
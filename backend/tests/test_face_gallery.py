@@ -0,0 +1,170 @@
+import numpy as np
+import pytest
+
+import database
+import face_gallery
+import face_index
+from database import encode_embedding, get_db_connection
+from face_gallery import FaceGallery, normalize_embedding
+
+DIM = 512
+
+# (FACE_INDEX, FACE_QUANTIZATION)
+MODES = [('exact', 'none'), ('ivf', 'none'), ('exact', 'int8'), ('ivf', 'float16')]
+
+
+@pytest.fixture(autouse=True)
+def gallery_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "attendance.db"))
+    monkeypatch.setattr(face_gallery, "SNAPSHOT_PATH", str(tmp_path / "face_gallery.f32"))
+    monkeypatch.setattr(face_gallery, "SNAPSHOT_META_PATH", str(tmp_path / "face_gallery.json"))
+    monkeypatch.setattr(face_index, "INDEX_PATH", str(tmp_path / "face_index.npz"))
+    database.init_database()
+
+
+@pytest.fixture(params=MODES, ids=lambda mode: "+".join(mode))
+def index_mode(request, monkeypatch):
+    kind, quantization = request.param
+    monkeypatch.setattr(face_index, "FACE_INDEX", kind)
+    monkeypatch.setattr(face_index, "FACE_QUANTIZATION", quantization)
+    # Small galleries get an IVF index too
+    monkeypatch.setattr(face_index, "IVF_MIN_GALLERY_SIZE", 1)
+    return request.param
+
+
+def execute(sql, params=()):
+    conn = get_db_connection()
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def expected_gallery():
+    """{employee_id: (name, normalized embedding)} read straight from the database"""
+    return {row[0]: (row[1], normalize_embedding(row[2])) for row in database.get_all_face_embedding_rows()}
+
+
+def inner_index(gallery):
+    index = gallery._get_state()[3]
+    return getattr(index, "inner", index)
+
+
+def enroll(count, rng):
+    for i in range(count):
+        execute("INSERT INTO employees (id, name, face_embedding) VALUES (?, ?, ?)",
+                (f"E{i}", f"employee {i}", encode_embedding(rng.standard_normal(DIM).astype(np.float32))))
+
+
+def assert_matches_database(gallery):
+    matrix, ids, names, index = gallery._get_state()
+    expected = expected_gallery()
+    assert sorted(ids) == sorted(expected)
+    for row, employee_id in enumerate(ids):
+        name, vector = expected[employee_id]
+        assert names[row] == name
+        np.testing.assert_array_equal(matrix[row], vector)
+        # Every enrolled face is found again through the index
+        assert gallery.match(vector)[:2] == (employee_id, name)
+
+    inner = inner_index(gallery)
+    if isinstance(inner, face_index.IVFFlatIndex):
+        # Each row sits in exactly one list, the one of its closest centroid
+        np.testing.assert_array_equal(inner.assignments, np.argmax(matrix @ inner.centroids.T, axis=1))
+        np.testing.assert_array_equal(np.sort(np.concatenate(inner.lists)), np.arange(len(ids)))
+        for list_id, rows in enumerate(inner.lists):
+            assert (inner.assignments[rows] == list_id).all()
+    if isinstance(index, face_index.QuantizedIndex):
+        codes, scales = face_index.quantize(matrix, index.mode)
+        np.testing.assert_array_equal(index.codes, codes)
+        if scales is not None:
+            np.testing.assert_array_equal(index.scales, scales)
+
+
+def test_incremental_changes_match_a_rebuild(index_mode):
+    rng = np.random.default_rng(0)
+
+    def embedding():
+        return rng.standard_normal(DIM).astype(np.float32)
+
+    enroll(40, rng)
+    gallery = FaceGallery()
+    gallery.preload()
+    if index_mode[0] == 'ivf':
+        assert "ivf" in gallery._get_state()[3].kind
+    next_id = 40
+
+    for step in range(120):
+        ids = gallery._get_state()[1]
+        op = rng.choice(["enroll", "photo", "rename", "same name", "remove"])
+        if op == "enroll" or len(ids) < 5:
+            employee_id, name, vector = f"E{next_id}", f"employee {next_id}", embedding()
+            next_id += 1
+            execute("INSERT INTO employees (id, name, face_embedding) VALUES (?, ?, ?)",
+                    (employee_id, name, encode_embedding(vector)))
+            gallery.upsert(employee_id, name, vector)
+            continue
+        employee_id = ids[rng.integers(len(ids))]
+        name = expected_gallery()[employee_id][0]
+        if op == "photo":
+            vector = embedding()
+            execute("UPDATE employees SET face_embedding = ? WHERE id = ?", (encode_embedding(vector), employee_id))
+            gallery.upsert(employee_id, name, vector)
+        elif op in ("rename", "same name"):
+            if op == "rename":
+                name = f"{name} ({step})"
+            execute("UPDATE employees SET name = ? WHERE id = ?", (name, employee_id))
+            gallery.rename(employee_id, name)
+        else:
+            execute("DELETE FROM employees WHERE id = ?", (employee_id,))
+            gallery.remove(employee_id)
+        if step % 20 == 0:
+            assert_matches_database(gallery)
+
+    assert_matches_database(gallery)
+    # A fresh process maps the snapshot and loads the saved index
+    reloaded = FaceGallery()
+    reloaded.preload()
+    assert reloaded._snapshot is not None
+    assert_matches_database(reloaded)
+    if index_mode[0] == 'ivf':
+        np.testing.assert_array_equal(inner_index(reloaded).centroids, inner_index(gallery).centroids)
+
+    # Photos updated by another process while this one wasn't running
+    for employee_id in reloaded._get_state()[1][:10]:
+        execute("UPDATE employees SET face_embedding = ? WHERE id = ?", (encode_embedding(embedding()), employee_id))
+    restarted = FaceGallery()
+    restarted.preload()
+    assert_matches_database(restarted)
+
+
+def test_saved_index_is_reassigned_after_outside_photo_updates(index_mode):
+    rng = np.random.default_rng(1)
+    enroll(60, rng)
+    gallery = FaceGallery()
+    gallery.preload()
+    # Photos updated by another process; no removals, so the saved index keeps its ids
+    for i in range(0, 60, 3):
+        execute("UPDATE employees SET face_embedding = ? WHERE id = ?",
+                (encode_embedding(rng.standard_normal(DIM).astype(np.float32)), f"E{i}"))
+    restarted = FaceGallery()
+    restarted.preload()
+    assert_matches_database(restarted)
+    if index_mode[0] == 'ivf':
+        # Reassigned to the saved centroids rather than retrained
+        np.testing.assert_array_equal(inner_index(restarted).centroids, inner_index(gallery).centroids)
+
+
+def test_removing_everyone_leaves_an_empty_snapshot(index_mode):
+    execute("INSERT INTO employees (id, name, face_embedding) VALUES (?, ?, ?)",
+            ("E0", "employee 0", encode_embedding(np.ones(DIM, dtype=np.float32))))
+    gallery = FaceGallery()
+    gallery.preload()
+    execute("DELETE FROM employees WHERE id = ?", ("E0",))
+    gallery.remove("E0")
+    assert gallery.match(np.ones(DIM)) is None
+
+    reloaded = FaceGallery()
+    assert len(reloaded) == 0
+    assert reloaded.match(np.ones(DIM)) is None
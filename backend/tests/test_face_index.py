@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from face_index import ExactIndex, QuantizedIndex, coarse_scores, quantize
+
+MODES = ['int8', 'float16']
+
+
+def random_gallery(rows, dim=512, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((rows, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def best_row(matrix, rows, query):
+    """Exact re-scoring of an index's candidates, as FaceGallery.match does it"""
+    if rows is None or len(rows) == 0:
+        return int(np.argmax(matrix @ query))
+    return int(rows[int(np.argmax(matrix[rows] @ query))])
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_coarse_scores_match_widened_codes(mode):
+    # Spans several coarse blocks, the last one partial, and includes an all-zero row
+    matrix = random_gallery(1000, seed=1)
+    matrix[7] = 0
+    codes, scales = quantize(matrix, mode)
+    query = random_gallery(1, seed=2)[0]
+
+    expected = codes.astype(np.float32) @ query
+    if scales is not None:
+        expected *= scales
+    np.testing.assert_allclose(coarse_scores(codes, scales, query), expected, rtol=1e-5, atol=1e-6)
+    # A subset of rows, as the IVF candidates are scored
+    rows = np.arange(3, 1000, 7)
+    subset = coarse_scores(codes[rows], None if scales is None else scales[rows], query)
+    np.testing.assert_allclose(subset, expected[rows], rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_quantized_top1_matches_exact(mode):
+    matrix = random_gallery(2000, seed=3)
+    exact = ExactIndex()
+    index = QuantizedIndex.build(ExactIndex(), matrix, mode)
+    rng = np.random.default_rng(4)
+    # Noisy captures of enrolled faces, and unrelated faces
+    queries = matrix[rng.integers(0, len(matrix), 50)] + 0.05 * rng.standard_normal((50, matrix.shape[1]))
+    queries = np.vstack([queries, rng.standard_normal((50, matrix.shape[1]))]).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    for query in queries:
+        rows = index.candidates(query)
+        assert len(rows) == index.rescore_k
+        assert best_row(matrix, rows, query) == best_row(matrix, exact.candidates(query), query)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_quantized_updates_match_rebuild(mode):
+    matrix = random_gallery(300, seed=5)
+    index = QuantizedIndex.build(ExactIndex(), matrix, mode)
+    extra = random_gallery(2, seed=6)
+
+    index = index.add(len(matrix), extra[0])
+    matrix = np.vstack([matrix, extra[0]])
+    index = index.update(10, extra[1])
+    matrix[10] = extra[1]
+    index = index.remove(20, len(matrix) - 1)
+    matrix[20] = matrix[-1]
+    matrix = matrix[:-1]
+
+    codes, scales = quantize(matrix, mode)
+    np.testing.assert_array_equal(index.codes, codes)
+    if scales is not None:
+        np.testing.assert_array_equal(index.scales, scales)
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+
+from inference_executor import InferenceExecutor, InferenceQueueFull
+
+
+async def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_cancelled_queued_call_releases_its_slot():
+    executor = InferenceExecutor(workers=1, queue_size=2)
+    release = threading.Event()
+    ran = []
+
+    async def scenario():
+        blocker = asyncio.ensure_future(executor.run(release.wait))
+        await wait_until(lambda: executor.stats()["running"] == 1)
+        queued = asyncio.ensure_future(executor.run(ran.append, "queued"))
+        await wait_until(lambda: executor.stats()["queue_depth"] == 1)
+        # The client behind the queued call disconnects
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        release.set()
+        await blocker
+        # Every slot is free again: workers + queue_size calls are all accepted
+        return await asyncio.gather(*(executor.run(lambda: "ok") for _ in range(3)))
+
+    try:
+        assert asyncio.run(scenario()) == ["ok"] * 3
+    finally:
+        executor._pool.shutdown()
+    stats = executor.stats()
+    assert ran == []
+    assert stats["queue_depth"] == 0
+    assert stats["running"] == 0
+    assert stats["cancelled"] == 1
+    assert stats["rejected"] == 0
+
+
+def test_rejects_beyond_workers_and_queue():
+    executor = InferenceExecutor(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def scenario():
+        calls = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await wait_until(lambda: executor.stats()["queue_depth"] == 1)
+        try:
+            await executor.run(release.wait)
+        except InferenceQueueFull:
+            rejected = True
+        else:
+            rejected = False
+        release.set()
+        await asyncio.gather(*calls)
+        return rejected
+
+    try:
+        assert asyncio.run(scenario())
+    finally:
+        executor._pool.shutdown()
+    assert executor.stats()["rejected"] == 1
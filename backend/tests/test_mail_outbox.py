@@ -0,0 +1,203 @@
+import socket
+import time
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+import database
+import mail_outbox
+from mail_outbox import OutboxSender, queue_email
+
+
+class RecordingHandler:
+    """Accepts every message, except recipients starting with "bad" which are refused"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("bad"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((list(envelope.rcpt_tos), envelope.content))
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def outbox_rows():
+    conn = database.get_db_connection()
+    try:
+        rows = conn.execute("SELECT id, to_email, status, attempts, next_attempt_at FROM email_outbox ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def make_due():
+    conn = database.get_db_connection()
+    try:
+        conn.execute("UPDATE email_outbox SET next_attempt_at = 0 WHERE status = 'pending'")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture(autouse=True)
+def outbox_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "attendance.db"))
+    database.init_database()
+    # queue_email wakes the module's sender, which isn't running in tests
+    monkeypatch.setattr(mail_outbox.outbox_sender, "wake", lambda: None)
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = RecordingHandler()
+    port = free_port()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(mail_outbox, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(mail_outbox, "SMTP_PORT", port)
+    monkeypatch.setattr(mail_outbox, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(mail_outbox, "SMTP_AUTH", False)
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+def sender():
+    sender = OutboxSender()
+    yield sender
+    sender.stop()
+
+
+def test_queued_emails_are_sent_over_one_session(smtp_server, sender):
+    for i in range(3):
+        queue_email(f"user{i}@example.com", f"Subject {i}", f"Body {i}")
+    assert [row["status"] for row in outbox_rows()] == ["pending"] * 3
+
+    assert sender.drain_once() == 3
+    assert [rcpt for rcpt, _ in smtp_server.messages] == [[f"user{i}@example.com"] for i in range(3)]
+    assert [row["status"] for row in outbox_rows()] == ["sent"] * 3
+    assert sender.connections == 1
+    assert sender.drain_once() == 0
+
+
+def test_rejected_recipient_does_not_drop_the_batch(smtp_server, sender):
+    queue_email("bad@example.com", "Subject", "Body")
+    for i in range(3):
+        queue_email(f"user{i}@example.com", "Subject", "Body")
+
+    assert sender.drain_once() == 3
+    rows = outbox_rows()
+    assert [(row["status"], row["attempts"]) for row in rows] == [("pending", 1)] + [("sent", 1)] * 3
+    # A refused recipient is a per-message error; the session stays open and is reused
+    assert sender.connections == 1
+    assert sender.stats()["session_open"]
+
+
+def test_failed_email_is_retried_with_backoff(smtp_server, sender, monkeypatch):
+    monkeypatch.setattr(mail_outbox, "EMAIL_RETRY_BASE_S", 30)
+    queue_email("bad@example.com", "Subject", "Body")
+
+    before = time.time()
+    assert sender.drain_once() == 0
+    row = outbox_rows()[0]
+    assert row["attempts"] == 1
+    assert before + 30 <= row["next_attempt_at"] <= time.time() + 30
+
+    # Not due yet: nothing is attempted
+    assert sender.drain_once() == 0
+    assert outbox_rows()[0]["attempts"] == 1
+
+    make_due()
+    before = time.time()
+    sender.drain_once()
+    row = outbox_rows()[0]
+    assert row["attempts"] == 2
+    assert before + 60 <= row["next_attempt_at"] <= time.time() + 60
+
+
+def test_email_is_given_up_after_max_attempts(smtp_server, sender, monkeypatch):
+    monkeypatch.setattr(mail_outbox, "EMAIL_MAX_ATTEMPTS", 3)
+    queue_email("bad@example.com", "Subject", "Body")
+
+    for _ in range(5):
+        sender.drain_once()
+        make_due()
+    row = outbox_rows()[0]
+    assert (row["status"], row["attempts"]) == ("failed", 3)
+    assert sender.stats()["given_up"] == 1
+    assert sender.stats()["queue_depth"] == 0
+
+
+def test_unreachable_server_keeps_the_rest_of_the_batch(sender, monkeypatch):
+    monkeypatch.setattr(mail_outbox, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(mail_outbox, "SMTP_PORT", free_port())
+    monkeypatch.setattr(mail_outbox, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(mail_outbox, "SMTP_AUTH", False)
+    for i in range(3):
+        queue_email(f"user{i}@example.com", "Subject", "Body")
+
+    assert sender.drain_once() == 0
+    rows = outbox_rows()
+    assert [row["attempts"] for row in rows] == [1, 0, 0]
+    # The unattempted emails are handed back, not left claimed
+    assert [row["status"] for row in rows] == ["pending"] * 3
+    assert not sender.stats()["session_open"]
+
+
+def expire_leases():
+    conn = database.get_db_connection()
+    try:
+        conn.execute("UPDATE email_outbox SET lease_until = 0 WHERE status = 'sending'")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_emails_claimed_by_another_sender_are_skipped(smtp_server, sender):
+    for i in range(3):
+        queue_email(f"user{i}@example.com", "Subject", "Body")
+    # The sender of another API process claimed the batch
+    claimed = database.claim_due_emails(time.time(), 20, 300)
+    assert [email["to_email"] for email in claimed] == [f"user{i}@example.com" for i in range(3)]
+
+    assert sender.drain_once() == 0
+    assert smtp_server.messages == []
+    assert sender.stats()["queue_depth"] == 3
+
+
+def test_each_email_is_recorded_as_soon_as_it_is_sent(smtp_server, sender, monkeypatch):
+    for i in range(3):
+        queue_email(f"user{i}@example.com", "Subject", "Body")
+    send = sender._send
+
+    def crash_on_second(email):
+        if email["to_email"] == "user1@example.com":
+            raise KeyboardInterrupt  # the process dies mid-batch
+        send(email)
+
+    monkeypatch.setattr(sender, "_send", crash_on_second)
+    with pytest.raises(KeyboardInterrupt):
+        sender.drain_once()
+    assert [row["status"] for row in outbox_rows()] == ["sent", "sending", "sending"]
+
+    # Once the dead sender's lease runs out, another one sends only what's left
+    expire_leases()
+    other = OutboxSender()
+    try:
+        assert other.drain_once() == 2
+    finally:
+        other.stop()
+    assert [rcpt for rcpt, _ in smtp_server.messages] == [[f"user{i}@example.com"] for i in range(3)]
+    assert [row["status"] for row in outbox_rows()] == ["sent"] * 3
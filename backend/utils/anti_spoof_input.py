@@ -0,0 +1,12 @@
+import cv2
+import numpy as np
+
+# MiniFASNet input resolution (width, height)
+INPUT_SIZE = (80, 80)
+
+
+def fill_input(out, crop):
+    """Write one BGR face crop into a preallocated (3, H, W) float32 slot as RGB in [0, 1]"""
+    img = cv2.resize(crop, INPUT_SIZE)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    np.multiply(np.transpose(img, (2, 0, 1)), 1.0 / 255.0, out=out, casting='unsafe')
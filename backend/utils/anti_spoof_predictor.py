@@ -1,14 +1,15 @@
+import threading
 import torch
 import torch.nn.functional as F
-import cv2
 import numpy as np
 from utils.models.mfasnet import MiniFASNetV1SE
+from utils.anti_spoof_input import INPUT_SIZE, fill_input
 
 
 class AntiSpoofPredictor:
-    def __init__(self, model_path):
+    def __init__(self, model_path, max_batch_size=8):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = MiniFASNetV1SE(input_size=(80, 80))
+        self.model = MiniFASNetV1SE(input_size=INPUT_SIZE)
         state_dict = torch.load(model_path, map_location=self.device)
 
         # Remove "module." if present in keys
@@ -16,15 +17,27 @@ class AntiSpoofPredictor:
         self.model.load_state_dict(new_state_dict, strict=False)
         self.model.to(self.device).eval()
 
-    def predict(self, frame):
-        img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = cv2.resize(img, (80, 80))
-        img = img.astype(np.float32) / 255.0
-        img = np.transpose(img, (2, 0, 1))
-        img = np.expand_dims(img, axis=0)
-        input_tensor = torch.from_numpy(img).to(self.device)
+        # Input batch allocated once and filled in place on every call; the buffer is shared,
+        # so calls are serialized
+        self.max_batch_size = max_batch_size
+        self._input = torch.empty((max_batch_size, 3, INPUT_SIZE[1], INPUT_SIZE[0]), dtype=torch.float32)
+        if self.device.type == "cuda":
+            self._input = self._input.pin_memory()
+        self._input_np = self._input.numpy()
+        self._lock = threading.Lock()
+
+    def predict_batch(self, crops):
+        """Probability of being real for each BGR face crop"""
+        scores = np.empty(len(crops), dtype=np.float32)
+        with self._lock, torch.no_grad():
+            for start in range(0, len(crops), self.max_batch_size):
+                chunk = crops[start:start + self.max_batch_size]
+                for slot, crop in enumerate(chunk):
+                    fill_input(self._input_np[slot], crop)
+                input_tensor = self._input[:len(chunk)].to(self.device, non_blocking=True)
+                output = self.model(input_tensor)
+                scores[start:start + len(chunk)] = F.softmax(output, dim=1)[:, 1].cpu().numpy()
+        return scores
 
-        with torch.no_grad():
-            output = self.model(input_tensor)
-            probabilities = F.softmax(output, dim=1).cpu().numpy()
-            return probabilities[0][1]  # Probability of being real
+    def predict(self, frame):
+        return self.predict_batch([frame])[0]  # Probability of being real
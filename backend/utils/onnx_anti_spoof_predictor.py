@@ -0,0 +1,36 @@
+import threading
+import numpy as np
+import onnxruntime as ort
+from utils.anti_spoof_input import INPUT_SIZE, fill_input
+
+
+class OnnxAntiSpoofPredictor:
+    """AntiSpoofPredictor running an exported MiniFASNet on onnxruntime, without torch"""
+
+    def __init__(self, model_path, max_batch_size=8, providers=("CPUExecutionProvider",), threads=1):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=list(providers))
+        self.input_name = self.session.get_inputs()[0].name
+
+        # Input batch allocated once and filled in place on every call
+        self.max_batch_size = max_batch_size
+        self._input = np.empty((max_batch_size, 3, INPUT_SIZE[1], INPUT_SIZE[0]), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def predict_batch(self, crops):
+        """Probability of being real for each BGR face crop"""
+        scores = np.empty(len(crops), dtype=np.float32)
+        with self._lock:
+            for start in range(0, len(crops), self.max_batch_size):
+                chunk = crops[start:start + self.max_batch_size]
+                for slot, crop in enumerate(chunk):
+                    fill_input(self._input[slot], crop)
+                logits = self.session.run(None, {self.input_name: self._input[:len(chunk)]})[0]
+                # Softmax over the two classes, column 1 is "real"
+                exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+                scores[start:start + len(chunk)] = exp[:, 1] / exp.sum(axis=1)
+        return scores
+
+    def predict(self, frame):
+        return self.predict_batch([frame])[0]  # Probability of being real